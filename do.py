@@ -121,6 +121,14 @@ def uhd_test():
     )
 
 
+def bench(*args):
+    run(
+        [
+            "cd tests && {} -m utils.bench {}".format(py(), " ".join(args)),
+        ]
+    )
+
+
 def dist():
     clean()
     run(
@@ -19,6 +19,11 @@ def pytest_configure(config):
     utl.settings.load_from_pytest_command_line(config)
 
 
+def pytest_sessionfinish(session, exitstatus):
+    # called after all tests are run to remove captures spooled to disk
+    utl.cleanup_spool()
+
+
 @pytest.fixture
 def settings():
     # global settings
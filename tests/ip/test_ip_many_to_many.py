@@ -113,32 +113,43 @@ def captures_ok(api, cfg, utils, count, packets):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    src_mac = [[0x00, 0x10, 0x10, 0x20, 0x20, 0x10 + i] for i in range(count)]
-    dst_mac = [[0x00, 0x10, 0x10, 0x20, 0x20, 0x20 - i] for i in range(count)]
+    src_mac = [
+        bytearray([0x00, 0x10, 0x10, 0x20, 0x20, 0x10 + i])
+        for i in range(count)
+    ]
+    dst_mac = [
+        bytearray([0x00, 0x10, 0x10, 0x20, 0x20, 0x20 - i])
+        for i in range(count)
+    ]
 
-    src_ip = [[0x0A, 0x01, 0x01 + i, 0x01] for i in range(count)]
-    dst_ip = [[0x0A, 0x01, 0x01 + i, 0x02] for i in range(count)]
+    src_ip = [bytearray([0x0A, 0x01, 0x01 + i, 0x01]) for i in range(count)]
+    dst_ip = [bytearray([0x0A, 0x01, 0x01 + i, 0x02]) for i in range(count)]
 
-    src_port = [[0x13, 0x88 + i] for i in range(count)]
-    dst_port = [[0x07, 0xD0 + i] for i in range(count)]
+    src_port = [bytearray([0x13, 0x88 + i]) for i in range(count)]
+    dst_port = [bytearray([0x07, 0xD0 + i]) for i in range(count)]
+
+    classifier = utils.FrameClassifier([(0, 6), (6, 12), (26, 30), (30, 34)])
+    for i in range(count):
+        classifier.add_bucket(
+            "dev_%d" % (i + 1), [dst_mac[i], src_mac[i], src_ip[i], dst_ip[i]]
+        )
 
     cap_dict = utils.get_all_captures(api, cfg)
     assert len(cap_dict) == 1
+    store = list(cap_dict.values())[0]
     sizes = [128, 256]
-    size_dt = {128: [0 for i in range(count)], 256: [0 for i in range(count)]}
     if utils.settings.uhd:
-        uhd_sizes = [124, 252]
-
-    for b in cap_dict[list(cap_dict.keys())[0]]:
-        i = dst_mac.index(b[0:6])
-        assert b[0:6] == dst_mac[i] and b[6:12] == src_mac[i]
-        assert b[26:30] == src_ip[i] and b[30:34] in dst_ip[i]
-        if utils.settings.uhd:
-            assert len(b) in uhd_sizes
-        else:
-            assert len(b) in sizes
-            size_dt[len(b)][i] += 1
-        if len(b) == 256 or len(b) == 252:
-            assert b[34:36] == src_port[i] and b[36:38] in dst_port[i]
+        sizes = [124, 252]
+
+    summary = utils.summarize_capture(store)
+    summary.print_summary()
+    assert set(summary.sizes) <= set(sizes)
     if not utils.settings.uhd:
-        assert sum(size_dt[128]) + sum(size_dt[256]) == packets
+        assert sum(summary.sizes.values()) == packets
+
+    for _, b in utils.sample_frames(store):
+        i = classifier.classify(b)
+        assert i is not None
+        if len(b) == sizes[1]:
+            assert b[34:36] == src_port[i] and b[36:38] == dst_port[i]
+    classifier.print_counts()
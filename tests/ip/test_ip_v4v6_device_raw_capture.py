@@ -190,69 +190,39 @@ def captures_ok(api, cfg, utils, size, packets):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    src_mac = [[0x00, 0x10, 0x10, 0x20, 0x20, 0x10 + i] for i in range(10)]
-    dst_mac = [[0x00, 0x10, 0x10, 0x20, 0x20, 0x20 - i] for i in range(10)]
-    src_ip = [[0x0A, 0x01, 0x01 + i, 0x01] for i in range(10)]
-    dst_ip = [[0x0A, 0x01, 0x01 + i, 0x02] for i in range(10)]
+    src_mac = [
+        bytearray([0x00, 0x10, 0x10, 0x20, 0x20, 0x10 + i]) for i in range(10)
+    ]
+    dst_mac = [
+        bytearray([0x00, 0x10, 0x10, 0x20, 0x20, 0x20 - i]) for i in range(10)
+    ]
+    src_ip = [bytearray([0x0A, 0x01, 0x01 + i, 0x01]) for i in range(10)]
+    dst_ip = [bytearray([0x0A, 0x01, 0x01 + i, 0x02]) for i in range(10)]
     src_ip6 = [
-        [
-            0xAB,
-            0xCD + i,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x1A,
-        ]
-        for i in range(10)
+        bytearray([0xAB, 0xCD + i] + [0x00] * 13 + [0x1A]) for i in range(10)
     ]
     dst_ip6 = [
-        [
-            0xAB,
-            0xCD + i,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x2A,
-        ]
-        for i in range(10)
+        bytearray([0xAB, 0xCD + i] + [0x00] * 13 + [0x2A]) for i in range(10)
     ]
 
-    cap_dict = utils.get_all_captures(api, cfg)
-    assert len(cap_dict) == 1
-    size_dt = {size: [0 for i in range(10)]}
+    classifier = utils.FrameClassifier([(0, 6)])
+    for i in range(10):
+        classifier.add_bucket("mac_%d" % (i + 1), [dst_mac[i]])
+
+    names = utils.get_capture_port_names(cfg)
+    assert len(names) == 1
 
-    for index, b in enumerate(cap_dict[list(cap_dict.keys())[0]]):
-        try:
-            i = dst_mac.index(b[0:6])
-        except Exception:
+    for b in utils.iter_captures(api, cfg, names[0]):
+        i = classifier.classify(b)
+        if i is None:
             # To avoid packets that are not generated by configured flows
             continue
-        assert b[0:6] == dst_mac[i] and b[6:12] == src_mac[i]
+        assert b[6:12] == src_mac[i]
         if b[14] == 0x45:
             assert b[26:30] == src_ip[i] and b[30:34] == dst_ip[i]
         else:
             assert b[22:38] == src_ip6[i] and b[38:54] == dst_ip6[i]
         assert len(b) == size
-        size_dt[len(b)][i] += 1
+    classifier.print_counts()
 
-    assert sum(size_dt[size]) == packets
+    assert sum(classifier.counts) == packets
@@ -149,73 +149,50 @@ def captures_ok(api, cfg, utils, size, packets):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    src_mac = [[0x00, 0x10, 0x10, 0x20, 0x20, 0x10 + i] for i in range(10)]
-    dst_mac = [[0x00, 0x10, 0x10, 0x20, 0x20, 0x20 - i] for i in range(10)]
-    src_ip = [[0x0A, 0x01, 0x01 + i, 0x01] for i in range(10)]
-    dst_ip = [[0x0A, 0x01, 0x01 + i, 0x02] for i in range(10)]
+    src_mac = [
+        bytearray([0x00, 0x10, 0x10, 0x20, 0x20, 0x10 + i]) for i in range(10)
+    ]
+    dst_mac = [
+        bytearray([0x00, 0x10, 0x10, 0x20, 0x20, 0x20 - i]) for i in range(10)
+    ]
+    src_ip = [bytearray([0x0A, 0x01, 0x01 + i, 0x01]) for i in range(10)]
+    dst_ip = [bytearray([0x0A, 0x01, 0x01 + i, 0x02]) for i in range(10)]
     src_ip6 = [
-        [
-            0xAB,
-            0xCD + i,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x1A,
-        ]
-        for i in range(10)
+        bytearray([0xAB, 0xCD + i] + [0x00] * 13 + [0x1A]) for i in range(10)
     ]
     dst_ip6 = [
-        [
-            0xAB,
-            0xCD + i,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x00,
-            0x2A,
-        ]
-        for i in range(10)
+        bytearray([0xAB, 0xCD + i] + [0x00] * 13 + [0x2A]) for i in range(10)
     ]
-    src_port = [[0x13, 0x88 + i] for i in range(10)]
-    dst_port = [[0x07, 0xD0 + i] for i in range(10)]
+    src_port = [bytearray([0x13, 0x88 + i]) for i in range(10)]
+    dst_port = [bytearray([0x07, 0xD0 + i]) for i in range(10)]
+
+    classifier = utils.FrameClassifier([(0, 6)])
+    for i in range(10):
+        classifier.add_bucket("mac_%d" % (i + 1), [dst_mac[i]])
 
     cap_dict = utils.get_all_captures(api, cfg)
     assert len(cap_dict) == 1
-    size_dt = {size: [0 for i in range(10)]}
+    store = list(cap_dict.values())[0]
+    summary = utils.CaptureSummary()
 
-    for index, b in enumerate(cap_dict[list(cap_dict.keys())[0]]):
-        try:
-            i = dst_mac.index(b[0:6])
-        except Exception:
+    for b in store:
+        i = classifier.classify(b)
+        if i is None:
             # To avoid packets that are not generated by configured flows
             continue
-        assert b[0:6] == dst_mac[i] and b[6:12] == src_mac[i]
+        assert b[6:12] == src_mac[i]
         if b[14] == 0x45:
             assert b[26:30] == src_ip[i] and b[30:34] == dst_ip[i]
             assert b[34:36] == src_port[i] and b[36:38] == dst_port[i]
         else:
             assert b[22:38] == src_ip6[i] and b[38:54] == dst_ip6[i]
             assert b[54:56] == src_port[i] and b[56:58] == dst_port[i]
-        assert len(b) == size
-        size_dt[len(b)][i] += 1
-
-    assert sum(size_dt[size]) == packets
+        summary.add(b)
+    classifier.print_counts()
+    summary.print_summary()
+
+    assert summary.sizes == {size: packets}
+    # each flow carries as many tcp 5-tuples as its ports increment through
+    tuples = sum(f.packet[-1].src_port.increment.count for f in cfg.flows)
+    tcp_flows = [k for k in summary.flows if k[2] == utils.IP_PROTO_TCP]
+    assert len(tcp_flows) == tuples
@@ -8,6 +8,7 @@ def test_counter_tcp_ports(api, utils, b2b_raw_config):
     Validate,
     - tx/rx frame count and bytes are as expected
     - all captured frames have expected src and dst ports
+    - captured frames match golden capture, if any
     """
     api.set_config(api.config())
     f = b2b_raw_config.flows[0]
@@ -53,40 +54,20 @@ def captures_ok(api, cfg, size, utils):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    src = [
-        [0x13, 0x88],
-        [0x13, 0x8A],
-        [0x13, 0x8C],
-        [0x13, 0x8E],
-        [0x13, 0x90],
-        [0x13, 0x92],
-        [0x13, 0x94],
-        [0x13, 0x96],
-        [0x13, 0x98],
-        [0x13, 0x9A],
-    ]
-    dst = [
-        [0x17, 0x70],
-        [0x17, 0x6E],
-        [0x17, 0x6C],
-        [0x17, 0x6A],
-        [0x17, 0x68],
-        [0x17, 0x66],
-        [0x17, 0x64],
-        [0x17, 0x62],
-        [0x17, 0x60],
-        [0x17, 0x5E],
-    ]
-
     cap_dict = utils.get_all_captures(api, cfg)
     assert len(cap_dict) == 1
 
     for k in cap_dict:
-        i = 0
-        for b in cap_dict[k]:
-            assert b[34:36] == src[i] and b[36:38] == dst[i]
-            i = (i + 1) % 10
-            if utils.settings.uhd:
-                assert len(b) == size - 4
-            else:
-                assert len(b) == size
+        frames, lengths = utils.capture_array(cap_dict[k])
+        utils.validate_columns(frames, utils.compile_flow(cfg.flows[0]))
+        if utils.settings.uhd:
+            assert (lengths == size - 4).all()
+        else:
+            assert (lengths == size).all()
+        # when capture_golden_dir setting is set, frames are compared against
+        # those recorded by an earlier run with capture_golden_record set,
+        # apart from payload carrying metrics instrumentation
+        diff = utils.check_golden(cap_dict[k], "test_counter_tcp_ports_" + k)
+        if diff is not None:
+            diff.print_report()
+            diff.assert_ok()
@@ -24,6 +24,8 @@ def test_list_tcp_ports(api, utils, b2b_raw_config):
     f.size.fixed = size
     f.rate.percentage = 10
     f.metrics.enable = True
+    # only headers are validated, hence payload need not be captured
+    utils.set_capture_snap_length(b2b_raw_config, 64)
 
     utils.start_traffic(api, b2b_raw_config)
     utils.wait_for(
@@ -48,27 +50,15 @@ def captures_ok(api, cfg, size, utils):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    src = [
-        [0x13, 0x88],
-        [0x13, 0xBA],
-        [0x13, 0x97],
-        [0x13, 0xB0],
-        [0x13, 0xA8],
-        [0x13, 0x9D],
-    ]
-    dst = [[0x17, 0x70], [0x17, 0x7F], [0x17, 0xA2]]
-
-    cap_dict = utils.get_all_captures(api, cfg)
+    # truncated as well, in case snap length of capture is not honored
+    cap_dict = utils.get_all_captures(api, cfg, snap_length=64)
     assert len(cap_dict) == 1
 
     for k in cap_dict:
-        i = 0
-        j = 0
-        for b in cap_dict[k]:
-            assert b[34:36] == src[i] and b[36:38] == dst[j]
-            i = (i + 1) % 6
-            j = (j + 1) % 3
-            if utils.settings.uhd:
-                assert len(b) == size - 4
-            else:
-                assert len(b) == size
+        frames, lengths = utils.capture_array(cap_dict[k])
+        utils.validate_columns(frames, utils.compile_flow(cfg.flows[0]))
+        utils.validate_lengths(cap_dict[k])
+        if utils.settings.uhd:
+            assert (lengths == size - 4).all()
+        else:
+            assert (lengths == size).all()
@@ -7,6 +7,7 @@ def test_tcp_flow_capture(api, b2b_raw_config, utils):
     Validate,
     - tx/rx frame count and bytes are as expected
     - all captured frames have expected src and dst ports
+    - all captured frames have valid IPv4 and TCP checksums
     """
     size = 1518
     packets = 100
@@ -52,27 +53,16 @@ def captures_ok(api, cfg, utils, size):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    src = [
-        [0x13, 0x88],
-        [0x13, 0xBA],
-        [0x13, 0x97],
-        [0x13, 0xB0],
-        [0x13, 0xA8],
-        [0x13, 0x9D],
-    ]
-    dst = [[0x17, 0x70], [0x17, 0x7F], [0x17, 0xA2]]
-
     cap_dict = utils.get_all_captures(api, cfg)
     assert len(cap_dict) == 1
 
     for k in cap_dict:
-        i = 0
-        j = 0
-        for b in cap_dict[k]:
-            assert b[34:36] == src[i] and b[36:38] == dst[j]
-            i = (i + 1) % 6
-            j = (j + 1) % 3
-            if utils.settings.uhd:
-                assert len(b) == size - 4
-            else:
-                assert len(b) == size
+        frames, lengths = utils.capture_array(cap_dict[k])
+        for start, end, values in utils.compile_flow(cfg.flows[0]):
+            utils.verify_sequence(frames, start, end, values).assert_ok()
+        utils.verify_checksums(cap_dict[k]).assert_ok()
+        if utils.settings.uhd:
+            assert (lengths == size - 4).all()
+        else:
+            assert (lengths == size).all()
+        utils.print_timing(utils.analyze_timing(cap_dict[k], names=[k]))
@@ -56,12 +56,13 @@ def captures_ok(api, cfg, size, utils):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    dst = [0x0F, 0xA0]
-    src = [0x0B, 0xB8]
-    cap_dict = utils.get_all_captures(api, cfg)
-    for k in cap_dict:
-        for b in cap_dict[k]:
-            assert b[36:38] == dst or b[34:36] == src
+    ports = utils.FieldExtractor(
+        ["ethernet", "ipv4", "udp"], ["udp.src_port", "udp.dst_port"]
+    )
+    for name in utils.get_capture_port_names(cfg):
+        for b in utils.iter_captures(api, cfg, name):
+            src_port, dst_port = ports.extract(b)
+            assert dst_port == 4000 or src_port == 3000
             if utils.settings.uhd:
                 assert len(b) == size - 4
             else:
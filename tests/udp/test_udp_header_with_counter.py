@@ -55,20 +55,14 @@ def captures_ok(api, cfg, size, utils):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    src = [src_port for src_port in range(5000, 5020, 2)]
-    dst = [dst_port for dst_port in range(6000, 5980, -2)]
     cap_dict = utils.get_all_captures(api, cfg)
     assert len(cap_dict) == 1
 
     for k in cap_dict:
-        i = 0
-        j = 0
-        for packet in cap_dict[k]:
-            assert utils.to_hex(packet[34:36]) == hex(src[i])
-            assert utils.to_hex(packet[36:38]) == hex(dst[i])
-            if utils.settings.uhd:
-                assert len(packet) == size - 4
-            else:
-                assert len(packet) == size
-            i = (i + 1) % 10
-            j = (j + 1) % 2
+        frames, lengths = utils.capture_array(cap_dict[k])
+        for start, end, values in utils.compile_flow(cfg.flows[0]):
+            utils.verify_sequence(frames, start, end, values).assert_ok()
+        if utils.settings.uhd:
+            assert (lengths == size - 4).all()
+        else:
+            assert (lengths == size).all()
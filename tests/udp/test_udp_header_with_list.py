@@ -50,18 +50,13 @@ def captures_ok(api, cfg, size, utils):
     """
     Returns normally if patterns in captured packets are as expected.
     """
-    src = [3000, 3001]
-    dst = [4000, 4001]
     cap_dict = utils.get_all_captures(api, cfg)
     assert len(cap_dict) == 1
 
     for k in cap_dict:
-        packet_num = 0
-        for packet in cap_dict[k]:
-            assert utils.to_hex(packet[34:36]) == hex(src[packet_num])
-            assert utils.to_hex(packet[36:38]) == hex(dst[packet_num])
-            if utils.settings.uhd:
-                assert len(packet) == size - 4
-            else:
-                assert len(packet) == size
-            packet_num = (packet_num + 1) % 2
+        frames, lengths = utils.capture_array(cap_dict[k])
+        utils.validate_columns(frames, utils.compile_flow(cfg.flows[0]))
+        if utils.settings.uhd:
+            assert (lengths == size - 4).all()
+        else:
+            assert (lengths == size).all()
@@ -0,0 +1,82 @@
+def test_udp_stream_capture(api, b2b_raw_config, utils):
+    """
+    Configure a raw udp flow with,
+    - fixed src and dst Port address
+    - 20000 frames of 128B size each
+    - 2000 frames per second
+
+    Validate,
+    - tx/rx frame count is as expected
+    - captures streamed in segments while traffic is running hold all
+      frames of the flow, except the ones sent while capture was being
+      restarted between segments
+    - all streamed frames have expected size
+    """
+    api.set_config(api.config())
+    f = b2b_raw_config.flows[0]
+    packets = 20000
+    size = 128
+    pps = 2000
+    interval_seconds = 2
+    f.packet.ethernet().ipv4().udp()
+    eth, ip, udp = f.packet[0], f.packet[1], f.packet[2]
+    eth.src.value = "00:0c:29:1d:10:67"
+    eth.dst.value = "00:0c:29:1d:10:71"
+    ip.src.value = "10.10.10.1"
+    ip.dst.value = "10.10.10.2"
+    udp.src_port.value = 3000
+    udp.dst_port.value = 4000
+
+    f.duration.fixed_packets.packets = packets
+    f.size.fixed = size
+    f.rate.pps = pps
+
+    f.metrics.enable = True
+
+    summary = utils.CaptureSummary()
+    utils.start_traffic(api, b2b_raw_config)
+    counts, gap_seconds = utils.stream_captures(
+        api,
+        b2b_raw_config,
+        lambda port, frame, ts: summary.add(frame, ts),
+        interval_seconds=interval_seconds,
+    )
+    utils.wait_for(
+        lambda: stats_ok(api, size, packets, utils), "stats to be as expected"
+    )
+    summary.print_summary()
+    assert sum(counts.values()) == summary.frames
+
+    # a segment may miss a frame in flight besides the ones sent in its gap
+    segments = packets // (pps * interval_seconds) + 2
+    captures_ok(summary, size, packets, pps * gap_seconds + segments, utils)
+
+
+def stats_ok(api, size, packets, utils):
+    """
+    Returns true if stats are as expected, false otherwise.
+    """
+    port_results, flow_results = utils.get_all_stats(api)
+
+    ok = utils.total_frames_ok(port_results, flow_results, packets)
+    ok = ok and utils.total_bytes_ok(
+        port_results, flow_results, packets * size
+    )
+    if utils.flow_transmit_matches(flow_results, "stopped") and not ok:
+        raise Exception("Stats not ok after flows are stopped")
+
+    return ok
+
+
+def captures_ok(summary, size, packets, max_lost, utils):
+    """
+    Returns normally if streamed captures account for all frames of the
+    flow, but for at most `max_lost` frames missed between segments.
+    """
+    if utils.settings.uhd:
+        size -= 4
+    key = ("10.10.10.1", "10.10.10.2", utils.IP_PROTO_UDP, 3000, 4000)
+    frames = summary.flows.get(key, [0, 0])[0]
+    print("Missed %d frames between capture segments" % (packets - frames))
+    assert 0 <= packets - frames <= max_lost
+    assert list(summary.sizes) == [size]
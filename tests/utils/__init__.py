@@ -1,3 +1,15 @@
 from .common import *
+from .capture import *
+from .validate import *
+from .patterns import *
+from .analysis import *
+from .export import *
+from .timing import *
+from .sequence import *
+from .parallel import *
+from .checksum import *
+from .golden import *
+from .tunnel import *
+from .latency import *
 
 __all__ = ['*']
@@ -0,0 +1,163 @@
+import socket
+import struct
+
+
+ETHER_TYPE_IPV4 = 0x0800
+ETHER_TYPE_IPV6 = 0x86DD
+ETHER_TYPE_VLAN = (0x8100, 0x88A8)
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+
+
+class CaptureSummary(object):
+    """
+    Summary statistics of frames captured on a port, collected in a single
+    pass over the capture.
+    - sizes: frame size -> frames
+    - ether_types: ether type (after VLAN tags) -> frames
+    - protocols: IPv4 protocol / IPv6 next header -> frames
+    - flows: (src ip, dst ip, protocol, src port, dst port) -> [frames, bytes]
+      where ports are None for protocols other than TCP and UDP
+    - first_ts, last_ts: timestamp (in nanoseconds) of first and last frame
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.sizes = {}
+        self.ether_types = {}
+        self.protocols = {}
+        self.flows = {}
+        self.first_ts = None
+        self.last_ts = None
+
+    def add(self, frame, ts=0, length=None):
+        """
+        Accounts given frame (and its timestamp) in summary, where `length`
+        is original length of a frame truncated to a snap length.
+        """
+        size = len(frame)
+        wire_size = length or size
+        self.frames += 1
+        self.bytes += wire_size
+        self.sizes[wire_size] = self.sizes.get(wire_size, 0) + 1
+        if ts:
+            if self.first_ts is None or ts < self.first_ts:
+                self.first_ts = ts
+            if self.last_ts is None or ts > self.last_ts:
+                self.last_ts = ts
+
+        if size < 14:
+            return
+        offset = 12
+        (ether_type,) = struct.unpack_from("!H", frame, offset)
+        while ether_type in ETHER_TYPE_VLAN and size >= offset + 6:
+            offset += 4
+            (ether_type,) = struct.unpack_from("!H", frame, offset)
+        offset += 2
+        self.ether_types[ether_type] = self.ether_types.get(ether_type, 0) + 1
+
+        if ether_type == ETHER_TYPE_IPV4 and size >= offset + 20:
+            family, l4 = socket.AF_INET, offset + (frame[offset] & 0x0F) * 4
+            proto = frame[offset + 9]
+            src, dst = struct.unpack_from("4s4s", frame, offset + 12)
+        elif ether_type == ETHER_TYPE_IPV6 and size >= offset + 40:
+            family, l4 = socket.AF_INET6, offset + 40
+            proto = frame[offset + 6]
+            src, dst = struct.unpack_from("16s16s", frame, offset + 8)
+        else:
+            return
+        self.protocols[proto] = self.protocols.get(proto, 0) + 1
+
+        sport = dport = None
+        if proto in (IP_PROTO_TCP, IP_PROTO_UDP) and size >= l4 + 4:
+            sport, dport = struct.unpack_from("!HH", frame, l4)
+        key = (
+            socket.inet_ntop(family, src),
+            socket.inet_ntop(family, dst),
+            proto,
+            sport,
+            dport,
+        )
+        flow = self.flows.get(key)
+        if flow is None:
+            self.flows[key] = [1, wire_size]
+        else:
+            flow[0] += 1
+            flow[1] += wire_size
+
+    def duration(self):
+        """
+        Returns seconds elapsed between first and last captured frame.
+        """
+        if self.first_ts is None:
+            return 0
+        return (self.last_ts - self.first_ts) / 1e9
+
+    def print_summary(self):
+        row_format = "{:>20}{:>15}"
+        border = "-" * 40
+        print("\nCapture Summary")
+        print(border)
+        print(row_format.format("Frames", self.frames))
+        print(row_format.format("Bytes", self.bytes))
+        print(row_format.format("Duration (s)", "%.6f" % self.duration()))
+        print(border)
+        print(row_format.format("Frame Size", "Frames"))
+        for size in sorted(self.sizes):
+            print(row_format.format(size, self.sizes[size]))
+        print(border)
+        print(row_format.format("Ether Type", "Frames"))
+        for ether_type in sorted(self.ether_types):
+            print(
+                row_format.format(
+                    "0x%04x" % ether_type, self.ether_types[ether_type]
+                )
+            )
+        print(border)
+        print(row_format.format("IP Protocol", "Frames"))
+        for proto in sorted(self.protocols):
+            print(row_format.format(proto, self.protocols[proto]))
+        print(border)
+        print("")
+
+        row_format = "{:>25}{:>25}{:>7}{:>7}{:>7}{:>12}{:>12}"
+        border = "-" * 95
+        print("Flows")
+        print(border)
+        print(
+            row_format.format(
+                "Src IP",
+                "Dst IP",
+                "Proto",
+                "Sport",
+                "Dport",
+                "Frames",
+                "Bytes",
+            )
+        )
+        for key in sorted(self.flows, key=str):
+            src, dst, proto, sport, dport = key
+            print(
+                row_format.format(
+                    src,
+                    dst,
+                    proto,
+                    "-" if sport is None else sport,
+                    "-" if dport is None else dport,
+                    self.flows[key][0],
+                    self.flows[key][1],
+                )
+            )
+        print(border)
+        print("")
+
+
+def summarize_capture(store):
+    """
+    Returns CaptureSummary of all frames held by given CaptureStore.
+    """
+    summary = CaptureSummary()
+    for ts, length, frame in zip(store.timestamps, store.wire_lengths, store):
+        summary.add(frame, ts, length)
+    return summary
@@ -0,0 +1,277 @@
+"""
+Micro-benchmarks for capture helpers, which do not need any traffic
+generator and can be run from tests dir as:
+python -m utils.bench [frames]
+"""
+import hashlib
+import io
+import os
+import struct
+import sys
+import time
+
+import dpkt
+
+from .capture import CaptureStore, iter_pcap, load_capture
+from .checksum import verify_checksums
+from .common import to_hex
+from .golden import diff_captures, frame_hashes
+from .latency import measure_latency
+from .parallel import report_captures
+from .patterns import FieldExtractor
+from .validate import capture_array, column_mismatches
+
+
+def synthetic_pcapng(frames, size=64):
+    """
+    Returns bytes of a pcapng file holding given number of UDP frames of
+    given size, each carrying a different source port and a valid IPv4
+    header checksum.
+    """
+    shb = struct.pack("<IIIHHqI", 0x0A0D0D0A, 28, 0x1A2B3C4D, 1, 0, -1, 28)
+    idb = struct.pack("<IIHHII", 0x00000001, 20, 1, 0, 0, 20)
+    padded = (size + 3) // 4 * 4
+    blen = 32 + padded
+    eth = b"\x00\x0c\x29\x1d\x10\x71\x00\x0c\x29\x1d\x10\x67\x08\x00"
+    ip = b"\x45\x00" + struct.pack(">H", size - 14) + b"\x00" * 5 + b"\x11"
+    ip += b"\x00\x00\x0a\x0a\x0a\x01\x0a\x0a\x0a\x02"
+    checksum = sum(struct.unpack(">10H", ip))
+    checksum = (checksum & 0xFFFF) + (checksum >> 16)
+    ip = ip[:10] + struct.pack(">H", ~checksum & 0xFFFF) + ip[12:]
+    tail = b"\x00" * (padded - len(eth) - len(ip) - 2)
+    blocks = [shb, idb]
+    for i in range(frames):
+        epb = [
+            struct.pack("<IIIIIII", 6, blen, 0, 0, i, size, size),
+            eth,
+            ip,
+            struct.pack(">H", i & 0xFFFF),
+            tail,
+            struct.pack("<I", blen),
+        ]
+        blocks.append(b"".join(epb))
+    return b"".join(blocks)
+
+
+def timed(label, func, frames):
+    start = time.time()
+    count = func()
+    elapsed = time.time() - start
+    print(
+        "{:<30}{:>12}{:>12.3f}{:>15.0f}".format(
+            label, count, elapsed, frames / elapsed if elapsed else 0
+        )
+    )
+    return count
+
+
+def bench_pcap_parser(frames=2000000):
+    """
+    Compares time taken by iter_pcap() and dpkt to walk all frames of a
+    synthetic pcapng file.
+    """
+    print("Generating pcapng with %d frames ..." % frames)
+    buf = synthetic_pcapng(frames)
+
+    def native():
+        count = 0
+        for ts, offset, length, wire_length in iter_pcap(buf):
+            count += 1
+        return count
+
+    def reference():
+        count = 0
+        for ts, pkt in dpkt.pcapng.Reader(io.BytesIO(buf)):
+            count += 1
+        return count
+
+    print("{:<30}{:>12}{:>12}{:>15}".format("Parser", "Frames", "Secs", "FPS"))
+    assert timed("iter_pcap", native, frames) == frames
+    assert timed("dpkt.pcapng.Reader", reference, frames) == frames
+
+
+def bench_field_extractor(frames=2000000):
+    """
+    Compares time taken to read UDP ports of every frame of a synthetic
+    capture using to_hex(), slicing and FieldExtractor.
+    """
+    print("Generating pcapng with %d frames ..." % frames)
+    store = load_capture(synthetic_pcapng(frames))
+    extractor = FieldExtractor(
+        ["ethernet", "ipv4", "udp"], ["udp.src_port", "udp.dst_port"]
+    )
+
+    def hex_strings():
+        count = 0
+        for frame in store:
+            to_hex(list(frame[34:36]))
+            to_hex(list(frame[36:38]))
+            count += 1
+        return count
+
+    def slices():
+        count = 0
+        for frame in store:
+            src_port = int.from_bytes(frame[34:36], "big")
+            dst_port = int.from_bytes(frame[36:38], "big")
+            count += src_port == count & 0xFFFF and dst_port == 0
+        return count
+
+    def extract():
+        count = 0
+        for frame in store:
+            src_port, dst_port = extractor.extract(frame)
+            count += src_port == count & 0xFFFF and dst_port == 0
+        return count
+
+    def extract_all():
+        count = 0
+        for src_port, dst_port in extractor.extract_all(store):
+            count += src_port == count & 0xFFFF and dst_port == 0
+        return count
+
+    print("{:<30}{:>12}{:>12}{:>15}".format("Method", "Frames", "Secs", "FPS"))
+    timed("to_hex", hex_strings, frames)
+    assert timed("slicing", slices, frames) == frames
+    assert timed("FieldExtractor.extract", extract, frames) == frames
+    assert timed("FieldExtractor.extract_all", extract_all, frames) == frames
+
+
+def bench_report_captures(frames=2000000, ports=4):
+    """
+    Compares time taken by report_captures() to parse and validate captures
+    of multiple ports, each holding given number of frames, using one worker
+    process against one worker process per port. Reports of worker processes
+    are first checked against validation done in this process, and shared
+    memory blocks are checked to be released when a worker fails.
+    """
+    print("Generating %d pcapng with %d frames each ..." % (ports, frames))
+    buf = synthetic_pcapng(frames)
+    buffers = [("port_%d" % i, buf) for i in range(ports)]
+    # source port of i-th frame is i & 0xFFFF
+    checks = [(34, 36, [struct.pack(">H", i) for i in range(1 << 16)])]
+
+    # corrupt source port of every 1000th frame on one of the ports
+    data = bytearray(buf)
+    for offset in load_capture(buf).offsets[::1000]:
+        data[offset + 34] ^= 0xFF
+    reports = report_captures([("port_0", data), ("port_1", buf)], checks, 2)
+    frames_array, _ = capture_array(load_capture(bytes(data)))
+    bad = column_mismatches(frames_array, 34, 36, checks[0][2])
+    mismatches = reports["port_0"].mismatches
+    assert len(mismatches) == 1
+    assert mismatches[0][2] == len(bad) and mismatches[0][3] == bad[0]
+    assert reports["port_1"].ok()
+
+    def shared_blocks():
+        return set(n for n in os.listdir("/dev/shm") if n.startswith("psm_"))
+
+    blocks = shared_blocks()
+    failed = False
+    try:
+        report_captures([("port_0", b"not a capture")], checks, 2)
+    except Exception:
+        failed = True
+    assert failed and shared_blocks() == blocks
+
+    def run(processes):
+        def func():
+            reports = report_captures(buffers, checks, processes)
+            for report in reports.values():
+                report.assert_ok()
+            return sum(r.frames for r in reports.values())
+
+        return func
+
+    print(
+        "{:<30}{:>12}{:>12}{:>15}".format("Workers", "Frames", "Secs", "FPS")
+    )
+    for processes in sorted(set([1, ports])):
+        label = "%d process(es)" % processes
+        timed(label, run(processes), frames * ports)
+
+
+def bench_checksums(frames=2000000):
+    """
+    Compares time taken to verify IPv4 header checksum of every frame of a
+    synthetic capture by summing 16 bit words of each frame in Python and
+    using verify_checksums().
+    """
+    print("Generating pcapng with %d frames ..." % frames)
+    store = load_capture(synthetic_pcapng(frames))
+
+    def per_frame():
+        count = 0
+        for frame in store:
+            total = sum(struct.unpack_from(">10H", frame, 14))
+            while total > 0xFFFF:
+                total = (total & 0xFFFF) + (total >> 16)
+            count += 1
+        return count
+
+    def vectorized():
+        return verify_checksums(store).ip_checked
+
+    print("{:<30}{:>12}{:>12}{:>15}".format("Method", "Frames", "Secs", "FPS"))
+    assert timed("per frame", per_frame, frames) == frames
+    assert timed("verify_checksums", vectorized, frames) == frames
+
+
+def bench_frame_hashes(frames=2000000):
+    """
+    Compares time taken to hash every frame of a synthetic capture using
+    hashlib per frame and frame_hashes(), after checking that corrupting a
+    frame changes its hash (e.g. flipping top bits of two 8 byte words),
+    hence golden diffs and latency matching do not pair corrupted frames,
+    and that payload is masked for golden diffs but not latency matching.
+    """
+    print("Generating pcapng with %d frames ..." % frames)
+    buf = synthetic_pcapng(frames)
+    store = load_capture(buf)
+
+    golden = load_capture(synthetic_pcapng(1))
+    frame = bytearray(golden[0])
+    frame[7] ^= 0x80
+    frame[15] ^= 0x80
+    corrupted = CaptureStore()
+    corrupted.append(bytes(frame), ts=1)
+    assert frame_hashes(corrupted, ())[0] != frame_hashes(golden, ())[0]
+    assert not diff_captures(corrupted, golden, mask=()).ok()
+    # corrupted frame is not taken to be the one transmitted
+    tx = CaptureStore()
+    tx.append(golden[0], ts=1)
+    assert measure_latency(tx, corrupted, mask=())[0].unmatched == 1
+    frame = bytearray(golden[0])
+    frame[-1] ^= 0xFF
+    changed = CaptureStore()
+    changed.append(bytes(frame), ts=1)
+    assert diff_captures(changed, golden).ok()
+    assert not diff_captures(changed, golden, mask=()).ok()
+    assert measure_latency(tx, changed)[0].unmatched == 1
+
+    def per_frame():
+        count = 0
+        for frame in store:
+            hashlib.blake2b(frame, digest_size=8).digest()
+            count += 1
+        return count
+
+    def vectorized():
+        return len(frame_hashes(store))
+
+    print("{:<30}{:>12}{:>12}{:>15}".format("Method", "Frames", "Secs", "FPS"))
+    assert timed("hashlib per frame", per_frame, frames) == frames
+    assert timed("frame_hashes", vectorized, frames) == frames
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    bench_pcap_parser(frames)
+    bench_field_extractor(frames)
+    bench_report_captures(frames)
+    bench_checksums(frames)
+    bench_frame_hashes(frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+import heapq
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+from array import array
+from operator import itemgetter
+
+
+# size of chunks in which captures are written to spool files
+SPOOL_CHUNK = 1 << 20
+# directory holding captures spooled to disk during current session, along
+# with memory maps opened on them
+SPOOL = {"dir": None, "maps": [], "lock": threading.Lock()}
+
+# pcap magic numbers mapped to byte order and nanoseconds per timestamp unit
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1000),
+    b"\xa1\xb2\xc3\xd4": (">", 1000),
+    b"\x4d\x3c\xb2\xa1": ("<", 1),
+    b"\xa1\xb2\x3c\x4d": (">", 1),
+}
+PCAP_HEADER_LEN = 24
+# pcapng block types and section header byte order magic
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_PB = 0x00000002
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BOM_LE = b"\x4d\x3c\x2b\x1a"
+# interface description block option holding timestamp resolution
+PCAPNG_IF_TSRESOL = 9
+
+
+class CaptureStore(object):
+    """
+    Holds all frames captured on a port in one contiguous buffer along with
+    an index of frame offsets, lengths and timestamps (in nanoseconds, 0 when
+    not known). Frames are handed out as memoryview slices of the buffer,
+    hence reading them involves no copy.
+    Original (wire) length of each frame is indexed as well, which exceeds
+    captured length when frames are truncated to a snap length.
+    Usage
+    -----
+    ```
+    store = CaptureStore()
+    for pkt in pkt_reader:
+        store.append(pkt)
+    for frame in store:
+        assert frame[26:30] == bytearray([0x0A, 0x01, 0x01, 0x01])
+    ```
+    Since the buffer can not be resized while a memoryview of it is alive,
+    all frames must be appended before any of them is read.
+    """
+
+    def __init__(self, data=None):
+        # when data is provided, frames are expected to be present in it and
+        # shall be indexed using add_frame() instead of append()
+        self.data = bytearray() if data is None else data
+        self.offsets = array("Q")
+        self.lengths = array("Q")
+        self.wire_lengths = array("Q")
+        self.timestamps = array("Q")
+
+    def append(self, frame, ts=0, wire_length=None):
+        """
+        Copies given frame at the end of buffer and indexes it.
+        """
+        self.offsets.append(len(self.data))
+        self.lengths.append(len(frame))
+        self.wire_lengths.append(wire_length or len(frame))
+        self.timestamps.append(ts)
+        self.data += frame
+
+    def add_frame(self, offset, length, ts=0, wire_length=None):
+        """
+        Indexes a frame which is already present in buffer at given offset.
+        """
+        if offset + length > len(self.data):
+            raise Exception(
+                "Frame at offset %d of length %d is out of bounds"
+                % (offset, length)
+            )
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.wire_lengths.append(wire_length or length)
+        self.timestamps.append(ts)
+
+    def view(self):
+        return memoryview(self.data)
+
+    def nbytes(self):
+        """
+        Returns number of bytes held by buffer and index.
+        """
+        index_bytes = self.offsets.itemsize * len(self.offsets)
+        index_bytes += self.lengths.itemsize * len(self.lengths)
+        index_bytes += self.wire_lengths.itemsize * len(self.wire_lengths)
+        index_bytes += self.timestamps.itemsize * len(self.timestamps)
+        return len(self.data) + index_bytes
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        offset = self.offsets[index]
+        end = offset + self.lengths[index]
+        return self.view()[offset:end]
+
+    def __iter__(self):
+        view = self.view()
+        for offset, length in zip(self.offsets, self.lengths):
+            end = offset + length
+            yield view[offset:end]
+
+
+def spool_path(name, suffix):
+    """
+    Returns path of a new file in spool directory, creating the directory
+    if it does not exist yet.
+    """
+    with SPOOL["lock"]:
+        if SPOOL["dir"] is None:
+            SPOOL["dir"] = tempfile.mkdtemp(prefix="snappi_captures_")
+    prefix = re.sub(r"[^\w.-]", "_", name) + "_"
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix=prefix, dir=SPOOL["dir"])
+    os.close(fd)
+    return path
+
+
+def map_spool(path):
+    """
+    Returns read only memory map of given spool file.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with SPOOL["lock"]:
+        SPOOL["maps"].append(mapped)
+    return mapped
+
+
+def spool_capture(fileobj, name):
+    """
+    Copies pcap bytes from given file like object to a spool file in chunks
+    and returns a read only memory map of it, which can be fed to pcap
+    parsers in place of the original file object. The file object is closed
+    once copied, releasing memory it holds (e.g. BytesIO).
+    """
+    path = spool_path(name, ".pcap")
+    fileobj.seek(0)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(fileobj, f, SPOOL_CHUNK)
+    fileobj.close()
+    if os.path.getsize(path) == 0:
+        raise Exception("No captures to be spooled for %s" % name)
+    return map_spool(path)
+
+
+def cleanup_spool():
+    """
+    Closes memory maps and removes all files spooled during the session.
+    """
+    with SPOOL["lock"]:
+        for mapped in SPOOL["maps"]:
+            try:
+                mapped.close()
+            except BufferError:
+                # a view of the map is still alive, it's released along with
+                # the view while the file is removed below
+                pass
+        SPOOL["maps"] = []
+        if SPOOL["dir"] is not None:
+            shutil.rmtree(SPOOL["dir"], ignore_errors=True)
+            SPOOL["dir"] = None
+
+
+class CaptureCache(object):
+    """
+    Persists raw pcap bytes in a local directory under a content address
+    (e.g. hash of config, port name and run id), so that captures can be
+    served again on a rerun without downloading them from controller.
+    Least recently used entries are evicted once total size of cached pcap
+    files exceeds `max_bytes` (unbounded when None).
+    Usage
+    -----
+    ```
+    cache = CaptureCache("/tmp/snappi_capture_cache", 1 << 30)
+    buf = cache.load(key)
+    if buf is None:
+        cache.put(key, api.get_capture(request))
+        buf = cache.load(key)
+    ```
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pcap")
+
+    def load(self, key):
+        """
+        Returns read only buffer of pcap bytes cached against given key, or
+        None when there's no such entry, and marks the entry as recently
+        used.
+        """
+        path = self.path(key)
+        with self.lock:
+            if not os.path.isfile(path):
+                return None
+            # modification time is used for recency since access time is
+            # not updated on file systems mounted with noatime
+            os.utime(path, None)
+            if os.path.getsize(path) == 0:
+                return b""
+            return map_spool(path)
+
+    def put(self, key, fileobj):
+        """
+        Copies pcap bytes from given file like object to cache in chunks,
+        evicting least recently used entries as needed. Captures larger than
+        the cache itself are not cached. Returns True if bytes were cached.
+        """
+        path = self.path(key)
+        tmp = "%s.%d.tmp" % (path, threading.current_thread().ident)
+        fileobj.seek(0)
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(fileobj, f, SPOOL_CHUNK)
+        fileobj.seek(0)
+        size = os.path.getsize(tmp)
+        if self.max_bytes is not None and size > self.max_bytes:
+            os.remove(tmp)
+            return False
+        with self.lock:
+            # rename is atomic, hence a partially written entry is never
+            # served to a concurrent reader
+            os.replace(tmp, path)
+            self.evict(keep=path)
+        return True
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries, except `keep`, until total size
+        of cached pcap files is within `max_bytes`.
+        """
+        if self.max_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pcap"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+
+def capture_buffer(fileobj):
+    """
+    Returns buffer holding bytes of given file like object, without copying
+    them when it's an in-memory stream.
+    """
+    if hasattr(fileobj, "getbuffer"):
+        return fileobj.getbuffer()
+    fileobj.seek(0)
+    return fileobj.read()
+
+
+def capture_format(buf):
+    """
+    Returns either "pcap" or "pcapng" based on magic bytes at the start of
+    given buffer.
+    """
+    magic = bytes(buf[:4])
+    if magic in PCAP_MAGIC:
+        return "pcap"
+    if struct.unpack("<I", magic)[0] == PCAPNG_SHB:
+        return "pcapng"
+    raise Exception("Unsupported capture format with magic 0x%s" % magic.hex())
+
+
+def iter_pcap(buf):
+    """
+    Yields (timestamp, offset, length, wire length) of every frame present in
+    given pcap or pcapng buffer, where timestamp is in nanoseconds, offset is
+    that of first byte of frame within the buffer, length is number of bytes
+    captured and wire length is original length of frame. Format is detected
+    from magic bytes and frames are neither copied nor decoded.
+    """
+    view = memoryview(buf)
+    if len(view) == 0:
+        return iter(())
+    if capture_format(view) == "pcap":
+        return iter_pcap_records(view)
+    return iter_pcapng_blocks(view)
+
+
+def iter_pcap_records(view):
+    """
+    Yields (timestamp, offset, length, wire length) of every record in a
+    pcap buffer.
+    """
+    order, ns_per_unit = PCAP_MAGIC[bytes(view[:4])]
+    unpack_record = struct.Struct(order + "IIII").unpack_from
+    offset = PCAP_HEADER_LEN
+    end = len(view)
+    while offset + 16 <= end:
+        sec, frac, caplen, wirelen = unpack_record(view, offset)
+        offset += 16
+        if offset + caplen > end:
+            raise Exception("Truncated pcap record at offset %d" % offset)
+        yield sec * 1000000000 + frac * ns_per_unit, offset, caplen, wirelen
+        offset += caplen
+
+
+def iter_pcapng_blocks(view):
+    """
+    Yields (timestamp, offset, length, wire length) of every packet in a
+    pcapng buffer,
+    walking enhanced, simple and (obsolete) packet blocks of all sections.
+    Simple packet blocks carry no timestamp, hence it's reported as 0.
+    """
+    offset = 0
+    end = len(view)
+    # section header block type reads the same in either byte order
+    unpack_header = struct.Struct("<II").unpack_from
+    while offset + 12 <= end:
+        btype, blen = unpack_header(view, offset)
+        if btype == PCAPNG_SHB:
+            # byte order and interfaces are specific to a section
+            (bom,) = struct.unpack_from("4s", view, offset + 8)
+            order = "<" if bom == PCAPNG_BOM_LE else ">"
+            unpack_header = struct.Struct(order + "II").unpack_from
+            unpack_epb = struct.Struct(order + "IIIII").unpack_from
+            unpack_pb = struct.Struct(order + "HHIIII").unpack_from
+            interfaces = []
+            btype, blen = unpack_header(view, offset)
+
+        if blen < 12 or offset + blen > end:
+            raise Exception("Truncated pcapng block at offset %d" % offset)
+
+        if btype == PCAPNG_EPB:
+            iface, high, low, caplen, wirelen = unpack_epb(view, offset + 8)
+            mul, div = interfaces[iface][1]
+            ts = ((high << 32) | low) * mul // div
+            yield ts, offset + 28, caplen, wirelen
+        elif btype == PCAPNG_SPB:
+            (wirelen,) = struct.unpack_from(order + "I", view, offset + 8)
+            caplen = min(wirelen, blen - 16)
+            if interfaces and interfaces[0][0]:
+                caplen = min(caplen, interfaces[0][0])
+            yield 0, offset + 12, caplen, wirelen
+        elif btype == PCAPNG_PB:
+            iface, _, high, low, caplen, wirelen = unpack_pb(view, offset + 8)
+            mul, div = interfaces[iface][1]
+            ts = ((high << 32) | low) * mul // div
+            yield ts, offset + 28, caplen, wirelen
+        elif btype == PCAPNG_IDB:
+            interfaces.append(pcapng_interface(view, offset, blen, order))
+
+        offset += blen
+
+
+def pcapng_interface(view, offset, blen, order):
+    """
+    Returns (snaplen, (mul, div)) for interface description block at given
+    offset, where timestamps of the interface are converted to nanoseconds
+    as timestamp * mul // div.
+    """
+    (snaplen,) = struct.unpack_from(order + "I", view, offset + 12)
+    units_per_sec = 1000000
+    opt = offset + 16
+    opt_end = offset + blen - 4
+    while opt + 4 <= opt_end:
+        code, length = struct.unpack_from(order + "HH", view, opt)
+        if code == 0:
+            break
+        if code == PCAPNG_IF_TSRESOL and length == 1:
+            tsresol = view[opt + 4]
+            if tsresol & 0x80:
+                units_per_sec = 1 << (tsresol & 0x7F)
+            else:
+                units_per_sec = 10**tsresol
+        opt += 4 + (length + 3) // 4 * 4
+
+    if 1000000000 % units_per_sec == 0:
+        return snaplen, (1000000000 // units_per_sec, 1)
+    return snaplen, (1000000000, units_per_sec)
+
+
+def load_capture(buf, snap_length=None):
+    """
+    Returns a CaptureStore indexing all frames of given pcap or pcapng buffer
+    in place, hence frames are not copied out of the buffer.
+    When `snap_length` is provided, only first `snap_length` bytes of each
+    frame are copied to a new buffer instead, along with original length of
+    frames, so that given buffer can be released once frames are loaded.
+    """
+    if snap_length:
+        return truncate_capture(buf, snap_length)
+    store = CaptureStore(data=buf)
+    offsets = store.offsets
+    lengths = store.lengths
+    wire_lengths = store.wire_lengths
+    timestamps = store.timestamps
+    for ts, offset, length, wire_length in iter_pcap(buf):
+        offsets.append(offset)
+        lengths.append(length)
+        wire_lengths.append(wire_length)
+        timestamps.append(ts)
+    return store
+
+
+def truncate_capture(buf, snap_length):
+    """
+    Returns a CaptureStore holding copy of first `snap_length` bytes of
+    each frame of given pcap or pcapng buffer (see load_capture()).
+    """
+    view = memoryview(buf)
+    store = CaptureStore()
+    offsets = store.offsets
+    lengths = store.lengths
+    wire_lengths = store.wire_lengths
+    timestamps = store.timestamps
+    # slices are gathered first and joined once, to avoid resizing buffer
+    # for every frame
+    slices = []
+    size = 0
+    for ts, offset, length, wire_length in iter_pcap(view):
+        length = min(length, snap_length)
+        end = offset + length
+        slices.append(view[offset:end])
+        offsets.append(size)
+        lengths.append(length)
+        wire_lengths.append(wire_length)
+        timestamps.append(ts)
+        size += length
+    store.data = bytearray(b"".join(slices))
+    return store
+
+
+def write_pcap(store, path):
+    """
+    Writes frames of given CaptureStore to a pcap file with nanosecond
+    timestamps, recording original length of truncated frames.
+    """
+    snap_length = max(store.lengths) if len(store) else 65535
+    with open(path, "wb") as f:
+        f.write(
+            struct.pack("<IHHiIII", 0xA1B23C4D, 2, 4, 0, 0, snap_length, 1)
+        )
+        for ts, wire_length, frame in zip(
+            store.timestamps, store.wire_lengths, store
+        ):
+            sec, nsec = divmod(ts, 1000000000)
+            f.write(struct.pack("<IIII", sec, nsec, len(frame), wire_length))
+            f.write(frame)
+
+
+def iter_frames(buf):
+    """
+    Yields (timestamp, frame) for every frame of given pcap or pcapng
+    buffer, where frame is a memoryview of its bytes.
+    """
+    view = memoryview(buf)
+    for ts, offset, length, _ in iter_pcap(view):
+        end = offset + length
+        yield ts, view[offset:end]
+
+
+def tag_frames(name, frames):
+    for ts, frame in frames:
+        yield ts, name, frame
+
+
+def merge_frames(readers):
+    """
+    Merges frames of multiple ports into a single stream ordered by
+    timestamp, yielding (timestamp, port name, frame), where readers is a
+    dictionary of port name and an iterable of (timestamp, frame) (e.g.
+    iter_frames()) ordered by timestamp. Frames are pulled from readers
+    lazily, one per port at a time, and frames with same timestamp are
+    yielded in the order of readers.
+    """
+    streams = [tag_frames(name, frames) for name, frames in readers.items()]
+    return heapq.merge(*streams, key=itemgetter(0))
+
+
+def merge_stores(cap_dict):
+    """
+    Merges frames of CaptureStores returned by get_all_captures() into a
+    single stream ordered by timestamp (see merge_frames()).
+    Usage
+    -----
+    ```
+    for ts, port_name, frame in merge_stores(cap_dict):
+        ...
+    ```
+    """
+    readers = {}
+    for name, store in cap_dict.items():
+        readers[name] = zip(store.timestamps, store)
+    return merge_frames(readers)
@@ -0,0 +1,246 @@
+import numpy as np
+
+from .analysis import IP_PROTO_TCP, IP_PROTO_UDP
+from .export import gather, header_window, l3_offsets, l4_offsets, to_uint
+from .timing import flow_buckets
+
+
+# upper bound on capture bytes summed at a time, to bound size of prefix sums
+CHECKSUM_CHUNK = 1 << 22
+# offset of checksum within TCP and UDP headers
+L4_CHECKSUM_OFFSET = {IP_PROTO_TCP: 16, IP_PROTO_UDP: 6}
+
+
+class ChecksumResult(object):
+    """
+    Outcome of verify_checksums() over frames of a capture.
+    - ip_checked, l4_checked: number of frames whose IPv4 header and TCP or
+      UDP checksums were verified (frames truncated by a snap length,
+      fragments and UDP datagrams without checksum are not verified)
+    - ip_errors, l4_errors: indices of frames with bad checksums
+    - flows: flow name -> [bad IPv4 checksums, bad TCP/UDP checksums] for
+      flows having bad checksums
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.ip_checked = 0
+        self.l4_checked = 0
+        self.ip_errors = np.empty(0, dtype=np.int64)
+        self.l4_errors = np.empty(0, dtype=np.int64)
+        self.flows = {}
+
+    def ok(self):
+        return len(self.ip_errors) == 0 and len(self.l4_errors) == 0
+
+    def assert_ok(self):
+        """
+        Raises AssertionError describing bad checksums, if any.
+        """
+        if self.ok():
+            return
+        raise AssertionError(
+            "Got %d/%d bad IPv4 header checksums and %d/%d bad TCP/UDP "
+            "checksums, first at frames %s and %s, in flows %s"
+            % (
+                len(self.ip_errors),
+                self.ip_checked,
+                len(self.l4_errors),
+                self.l4_checked,
+                self.ip_errors[:10].tolist(),
+                self.l4_errors[:10].tolist(),
+                sorted(self.flows)[:10],
+            )
+        )
+
+    def print_report(self):
+        row_format = "{:>50}{:>15}{:>15}"
+        border = "-" * 80
+        print("\nChecksum Report")
+        print(border)
+        print(row_format.format("Flow", "Bad IPv4", "Bad TCP/UDP"))
+        for name in sorted(self.flows):
+            print(row_format.format(name, *self.flows[name]))
+        print(
+            row_format.format(
+                "total", len(self.ip_errors), len(self.l4_errors)
+            )
+        )
+        print(row_format.format("checked", self.ip_checked, self.l4_checked))
+        print(border)
+        print("")
+
+
+def range_sums(buf, starts, ends):
+    """
+    Returns 16 bit ones-complement sums of byte ranges [start, end) of given
+    uint8 array, each read as big endian 16 bit words padded with a zero
+    byte when odd.
+    Sums are taken over a big endian uint16 view of the array using prefix
+    sums. Ranges starting at odd offsets are not aligned to words of the
+    view, which is fine since a ones-complement sum of byte swapped words
+    is the byte swapped sum (RFC 1071), hence their sums are swapped back.
+    """
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    low, high = int(starts.min()) // 2 * 2, int(ends.max())
+    data = buf[low:high]
+    if len(data) % 2:
+        data = np.append(data, np.uint8(0))
+    prefix = np.zeros(len(data) // 2 + 1, dtype=np.int64)
+    np.cumsum(data.view(">u2"), dtype=np.int64, out=prefix[1:])
+
+    start, end = starts - low, ends - low
+    odd_start, odd_end = start % 2 == 1, end % 2 == 1
+    sums = prefix[(end + 1) // 2] - prefix[start // 2]
+    # bytes outside of range sharing a word with first or last byte of range
+    before = data[np.maximum(start - 1, 0)].astype(np.int64) << 8
+    after = data[np.minimum(end, len(data) - 1)].astype(np.int64)
+    sums -= np.where(odd_start, before, 0)
+    sums -= np.where(odd_end, after, 0)
+    sums = fold(sums)
+    return np.where(odd_start, ((sums & 0xFF) << 8) | (sums >> 8), sums)
+
+
+def fold(sums):
+    """
+    Folds ones-complement sums to 16 bits.
+    """
+    sums = np.asarray(sums, dtype=np.int64)
+    for _ in range(3):
+        sums = (sums & 0xFFFF) + (sums >> 16)
+    return sums
+
+
+def chunk_bounds(starts, ends):
+    """
+    Yields (first, last) indices of consecutive ranges (sorted by start)
+    spanning upto CHECKSUM_CHUNK bytes, or a single range when larger.
+    """
+    first = 0
+    while first < len(starts):
+        limit = starts[first] + CHECKSUM_CHUNK
+        last = int(np.searchsorted(ends, limit, side="right"))
+        last = min(max(last, first + 1), len(starts))
+        yield first, last
+        first = last
+
+
+def chunked_sums(buf, starts, ends):
+    """
+    Returns range_sums() of given ranges, computed CHECKSUM_CHUNK bytes at
+    a time.
+    """
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    # running maximum keeps ends sorted for searching chunk bounds
+    max_ends = np.maximum.accumulate(ends) if len(ends) else ends
+    sums = np.zeros(len(starts), dtype=np.int64)
+    for first, last in chunk_bounds(starts, max_ends):
+        sums[first:last] = range_sums(
+            buf, starts[first:last], ends[first:last]
+        )
+    result = np.empty_like(sums)
+    result[order] = sums
+    return result
+
+
+def verify_checksums(store, buckets=None, names=None):
+    """
+    Verifies IPv4 header checksum and TCP or UDP checksum (including IPv4
+    or IPv6 pseudo header) of all frames of given CaptureStore, using
+    vectorized ones-complement sums over the capture buffer instead of
+    looping over frames. Returns a ChecksumResult where bad checksums are
+    accounted per group of frames, as given by `buckets` and `names` (see
+    analyze_timing()), which by default are flows (see flow_buckets()).
+    Usage
+    -----
+    ```
+    cap_dict = get_all_captures(api, cfg)
+    verify_checksums(cap_dict["rx"]).assert_ok()
+    ```
+    """
+    result = ChecksumResult(len(store))
+    if len(store) == 0:
+        return result
+    buf = np.frombuffer(store.data, dtype=np.uint8)
+    offsets = np.frombuffer(store.offsets, dtype=np.uint64).astype(np.int64)
+    lengths = np.frombuffer(store.lengths, dtype=np.uint64).astype(np.int64)
+    window = header_window(store)
+    l3, ether_type = l3_offsets(window)
+    ipv4, ipv6, protocol, l4 = l4_offsets(window, l3, ether_type)
+    header_length = l4 - l3
+
+    ip_length = np.where(
+        ipv4,
+        to_uint(gather(window, l3 + 2, 2)).astype(np.int64),
+        to_uint(gather(window, l3 + 4, 2)).astype(np.int64) + 40,
+    )
+    fragment = ipv4 & ((to_uint(gather(window, l3 + 6, 2)) & 0x3FFF) != 0)
+
+    ip_checked = ipv4 & (header_length >= 20) & (lengths >= l4)
+    starts = offsets + l3
+    ip_sums = fold(
+        chunked_sums(buf, starts[ip_checked], (offsets + l4)[ip_checked])
+    )
+    ip_bad = np.zeros(len(store), dtype=bool)
+    ip_bad[ip_checked] = ip_sums != 0xFFFF
+
+    # whole TCP or UDP segment needs to be captured
+    l4_length = ip_length - header_length
+    udp = protocol == IP_PROTO_UDP
+    checksum_offset = np.where(
+        udp, L4_CHECKSUM_OFFSET[IP_PROTO_UDP], L4_CHECKSUM_OFFSET[IP_PROTO_TCP]
+    )
+    l4_checked = (ipv4 & ip_checked) | ipv6
+    l4_checked &= np.isin(protocol, (IP_PROTO_TCP, IP_PROTO_UDP))
+    l4_checked &= ~fragment & (l4_length >= checksum_offset + 2)
+    l4_checked &= lengths >= l3 + ip_length
+    # UDP datagrams over IPv4 may not carry a checksum
+    rows = np.flatnonzero(l4_checked)
+    positions = offsets[rows] + l4[rows] + checksum_offset[rows]
+    checksums = (buf[positions].astype(np.int64) << 8) | buf[positions + 1]
+    l4_checked[rows[ipv4[rows] & udp[rows] & (checksums == 0)]] = False
+
+    starts = offsets + l4
+    sums = chunked_sums(
+        buf, starts[l4_checked], (starts + l4_length)[l4_checked]
+    )
+    # pseudo header holds addresses, protocol and length of segment
+    v4_addresses = gather(window, l3 + 12, 8)
+    v6_addresses = gather(window, l3 + 8, 32)
+    addresses = np.where(
+        ipv4[:, None],
+        np.pad(v4_addresses, ((0, 0), (0, 24))),
+        v6_addresses,
+    )[l4_checked].astype(np.int64)
+    sums += (addresses[:, 0::2] << 8).sum(axis=1)
+    sums += addresses[:, 1::2].sum(axis=1)
+    sums += protocol[l4_checked] + l4_length[l4_checked]
+    l4_bad = np.zeros(len(store), dtype=bool)
+    l4_bad[l4_checked] = fold(sums) != 0xFFFF
+
+    result.ip_checked = int(ip_checked.sum())
+    result.l4_checked = int(l4_checked.sum())
+    result.ip_errors = np.flatnonzero(ip_bad)
+    result.l4_errors = np.flatnonzero(l4_bad)
+    if result.ok():
+        return result
+
+    if buckets is None:
+        keys, buckets = flow_buckets(store)
+        names = [
+            "%s:%d > %s:%d (%d)" % (k[0], k[3], k[1], k[4], k[2]) for k in keys
+        ]
+    buckets = np.asarray(buckets, dtype=np.int64)
+    if names is None:
+        names = [str(i) for i in range(int(buckets.max()) + 1)]
+    known = buckets >= 0
+    ip_counts = np.bincount(buckets[ip_bad & known], minlength=len(names))
+    l4_counts = np.bincount(buckets[l4_bad & known], minlength=len(names))
+    for group in np.flatnonzero(ip_counts + l4_counts).tolist():
+        result.flows[names[group]] = [
+            int(ip_counts[group]),
+            int(l4_counts[group]),
+        ]
+    return result
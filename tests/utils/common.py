@@ -1,8 +1,20 @@
+import hashlib
 import json
 import os
 import sys
 import time
-import dpkt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .capture import (
+    CaptureCache,
+    capture_buffer,
+    iter_frames,
+    iter_pcap,
+    load_capture,
+    merge_frames,
+    spool_capture,
+)
+from .patterns import flow_port_names
 
 
 if sys.version_info[0] >= 3:
@@ -14,6 +26,9 @@ if sys.version_info[0] >= 3:
 SETTINGS_FILE = "settings.json"
 # path to dir containing traffic configurations relative root dir
 CONFIGS_DIR = "configs"
+# capture caches keyed by their directory, shared across calls so that
+# concurrent workers serialize access to the same directory
+CAPTURE_CACHES = {}
 
 
 def get_root_dir():
@@ -78,6 +93,20 @@ class Settings(object):
         self.license_servers = None
         self.ext = None
         self.promiscuous = None
+        self.uhd = None
+        self.capture_workers = None
+        self.capture_processes = None
+        self.capture_segment_seconds = None
+        self.capture_spool_bytes = None
+        self.capture_sample_confidence = None
+        self.capture_sample_error = None
+        self.capture_cache_dir = None
+        self.capture_cache_bytes = None
+        self.capture_run_id = None
+        self.capture_snap_length = None
+        self.capture_golden_dir = None
+        self.capture_golden_record = None
+        self.capture_tunnels = None
         self.settings_file = SETTINGS_FILE
 
         self.load_from_settings_file()
@@ -137,15 +166,13 @@ def start_traffic(api, cfg, start_capture=True):
     """
     Applies configuration, and starts flows.
     """
+    set_capture_snap_length(cfg)
     print("Setting config ...")
     check_warnings(api.set_config(cfg))
     capture_names = get_capture_port_names(cfg)
     if capture_names and start_capture:
         print("Starting capture on ports %s ..." % str(capture_names))
-        cs = api.control_state()
-        cs.port.capture.state = cs.port.capture.START
-        cs.port.capture.port_names = capture_names
-        check_warnings(api.set_control_state(cs))
+        set_capture_state(api, capture_names, start=True)
 
     if len(cfg.devices) > 0 or len(cfg.lags) > 0:
         print("Starting all protocols ...")
@@ -172,10 +199,39 @@ def stop_traffic(api, cfg=None, stop_capture=True):
     capture_names = get_capture_port_names(cfg)
     if capture_names and stop_capture:
         print("Stopping capture on ports %s ..." % str(capture_names))
-        cs = api.control_state()
+        set_capture_state(api, capture_names, start=False)
+
+
+def set_capture_snap_length(cfg, snap_length=None):
+    """
+    Limits number of bytes captured per frame to `snap_length`, which
+    defaults to `capture_snap_length` setting, on all captures of given
+    config not already limited. Original length of truncated frames is
+    still recorded in captures (see CaptureStore.wire_lengths).
+    Implementations not honoring packet size of a capture keep capturing
+    whole frames, hence captures are truncated as they are parsed as well
+    (see get_all_captures()).
+    """
+    if snap_length is None:
+        snap_length = getattr(settings, "capture_snap_length", None)
+    if not snap_length:
+        return
+    for cap in cfg.captures:
+        if cap._properties.get("packet_size") is None:
+            cap.packet_size = int(snap_length)
+
+
+def set_capture_state(api, port_names, start=True):
+    """
+    Starts or stops capture on given ports.
+    """
+    cs = api.control_state()
+    if start:
+        cs.port.capture.state = cs.port.capture.START
+    else:
         cs.port.capture.state = cs.port.capture.STOP
-        cs.port.capture.port_names = capture_names
-        check_warnings(api.set_control_state(cs))
+    cs.port.capture.port_names = port_names
+    check_warnings(api.set_control_state(cs))
 
 
 def seconds_elapsed(start_seconds):
@@ -320,46 +376,381 @@ def check_warnings(response):
         print("Warning: %s" % str(response.warnings))
 
 
-def get_all_captures(api, cfg):
+def fetch_capture(api, port_name):
     """
-    Returns a dictionary where port name is the key and value is a list of
-    frames where each frame is represented as a list of bytes.
+    Returns file like object holding pcap bytes captured on given port.
     """
-    cap_dict = {}
-    for name in get_capture_port_names(cfg):
-        print("Fetching captures from port %s" % name)
-        request = api.capture_request()
-        request.port_name = name
-        pcap_bytes = api.get_capture(request)
-
-        cap_dict[name] = []
-        if settings.uhd:
-            pkt_reader = dpkt.pcap.Reader(pcap_bytes)
-        else:
-            pkt_reader = dpkt.pcapng.Reader(pcap_bytes)
-        for ts, pkt in pkt_reader:
-            if sys.version_info[0] == 2:
-                cap_dict[name].append([ord(b) for b in pkt])
+    print("Fetching captures from port %s" % port_name)
+    request = api.capture_request()
+    request.port_name = port_name
+    return api.get_capture(request)
+
+
+def read_captures(pcap_bytes):
+    """
+    Yields frames from given pcap or pcapng bytes one at a time, each as a
+    memoryview of its raw bytes.
+    """
+    for ts, frame in iter_frames(capture_buffer(pcap_bytes)):
+        yield frame
+
+
+def iter_captures(api, cfg, port_name):
+    """
+    Yields frames captured on given port one at a time, as read by the pcap
+    parser, so that callers may validate captures without holding every
+    frame in memory. Each frame is yielded as a memoryview of raw bytes.
+    """
+    if port_name not in get_capture_port_names(cfg):
+        raise Exception("Capture is not enabled on port %s" % port_name)
+
+    for pkt in read_captures(fetch_capture(api, port_name)):
+        yield pkt
+
+
+def iter_merged_captures(api, cfg, port_names=None):
+    """
+    Yields (timestamp, port name, frame) for frames captured on given ports
+    (all capture ports by default), merged into a single stream ordered by
+    timestamp, e.g. to pair requests and responses of bidirectional flows.
+    Pcap bytes of each port are fetched once, but frames are neither copied
+    nor indexed upfront.
+    Usage
+    -----
+    ```
+    for ts, port_name, frame in iter_merged_captures(api, cfg):
+        ...
+    ```
+    """
+    capture_names = get_capture_port_names(cfg)
+    if port_names is None:
+        port_names = capture_names
+    readers = {}
+    for name in port_names:
+        if name not in capture_names:
+            raise Exception("Capture is not enabled on port %s" % name)
+        readers[name] = iter_frames(capture_buffer(fetch_capture(api, name)))
+
+    for item in merge_frames(readers):
+        yield item
+
+
+def transmit_stopped(api):
+    """
+    Returns true if all flows have stopped transmitting.
+    """
+    _, flow_results = get_all_stats(api, print_output=False)
+    return all([f.transmit == "stopped" for f in flow_results])
+
+
+def stream_captures(
+    api,
+    cfg,
+    on_frame,
+    done=None,
+    interval_seconds=None,
+    timeout_seconds=None,
+):
+    """
+    Retrieves captures in segments while traffic is running, so that
+    download and validation overlap with transmission, and feeds every
+    frame to `on_frame(port_name, frame, ts)` (e.g. a streaming validator
+    like CaptureSummary or FrameClassifier) as segments arrive.
+    Capture is expected to be started along with traffic (see
+    start_traffic()). Every `interval_seconds` (`capture_segment_seconds`
+    setting by default), capture is stopped, fetched from all capture ports
+    and restarted right away, while frames of fetched segment are fed in a
+    background thread. Once `done()` returns true (by default when all
+    flows have stopped transmitting) the last segment is fetched.
+    Since the controller holds one capture buffer per port, frames arriving
+    in the short window between stopping and restarting capture are not
+    captured, hence validators fed this way must not expect every frame.
+    Returns a dictionary of port name and number of frames fed, along with
+    total seconds spent between stopping and restarting capture, which
+    bounds frames missed as rate times gap (plus a frame per segment).
+    Usage
+    -----
+    ```
+    summary = CaptureSummary()
+    start_traffic(api, cfg)
+    counts, gap_seconds = stream_captures(
+        api, cfg, lambda port, frame, ts: summary.add(frame, ts)
+    )
+    ```
+    """
+    names = get_capture_port_names(cfg)
+    if not names:
+        raise Exception("Capture is not enabled on any port")
+    if done is None:
+
+        def done():
+            return transmit_stopped(api)
+
+    if interval_seconds is None:
+        interval_seconds = getattr(settings, "capture_segment_seconds", None)
+    interval_seconds = float(interval_seconds or settings.interval_seconds)
+    if timeout_seconds is None:
+        timeout_seconds = settings.timeout_seconds
+
+    counts = {name: 0 for name in names}
+    gap_seconds = 0
+
+    def feed(segment, pcap_bytes):
+        for name in names:
+            frames = 0
+            buf = memoryview(capture_buffer(pcap_bytes[name]))
+            for ts, offset, length, _ in iter_pcap(buf):
+                end = offset + length
+                on_frame(name, buf[offset:end], ts)
+                frames += 1
+            counts[name] += frames
+            print(
+                "Validated %d frames of segment %d from port %s"
+                % (frames, segment, name)
+            )
+
+    start = time.time()
+    segment = 0
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            finished = done()
+            if not finished and not timed_out(start, timeout_seconds):
+                time.sleep(interval_seconds)
+                finished = done()
+            last = finished or timed_out(start, timeout_seconds)
+            stopped = time.time()
+            set_capture_state(api, names, start=False)
+            pcap_bytes = {name: fetch_capture(api, name) for name in names}
+            if not last:
+                set_capture_state(api, names, start=True)
+                gap_seconds += time.time() - stopped
+            # segments are fed in order, one at a time
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(feed, segment, pcap_bytes)
+            segment += 1
+            if last:
+                break
+        pending.result()
+
+    if not finished:
+        raise Exception("Time out occurred while streaming captures")
+    return counts, gap_seconds
+
+
+def get_capture_store(
+    api,
+    port_name,
+    spool_bytes=None,
+    cache=None,
+    cache_key=None,
+    snap_length=None,
+):
+    """
+    Fetches and parses captures from given port into a CaptureStore.
+    Returns the store along with seconds spent on download and parsing.
+    If size of captured pcap bytes exceeds `spool_bytes`, pcap bytes are
+    spilled to disk and frames are read back through a memory map.
+    Since api.get_capture() returns a whole capture in memory, spooling does
+    not lower peak memory during download, but bounds memory held by a
+    capture once it's downloaded, i.e. for rest of test.
+    When a CaptureCache is provided, pcap bytes cached against `cache_key`
+    are used instead of downloading them, and downloaded pcap bytes are
+    cached otherwise.
+    When `snap_length` is provided, only first `snap_length` bytes of each
+    frame are kept (see load_capture()).
+    """
+    start = time.time()
+    buf = None if cache is None else cache.load(cache_key)
+    if buf is not None:
+        print("Serving captures of port %s from cache" % port_name)
+        fetched = time.time()
+    else:
+        pcap_bytes = fetch_capture(api, port_name)
+        fetched = time.time()
+        cached = cache is not None and cache.put(cache_key, pcap_bytes)
+
+        size = capture_size(pcap_bytes)
+        if spool_bytes is not None and size > spool_bytes:
+            if cached:
+                # cached pcap file is mapped instead of spooling another copy
+                buf = cache.load(cache_key)
             else:
-                cap_dict[name].append(list(pkt))
+                print("Spooling captures from port %s to disk" % port_name)
+                buf = spool_capture(pcap_bytes, port_name)
+        else:
+            buf = capture_buffer(pcap_bytes)
+    # frames are indexed in place within pcap bytes, unless truncated
+    store = load_capture(buf, snap_length)
+
+    return store, fetched - start, time.time() - fetched
+
 
-    return cap_dict
+def capture_size(pcap_bytes):
+    """
+    Returns number of bytes held by given file like object.
+    """
+    pcap_bytes.seek(0, os.SEEK_END)
+    size = pcap_bytes.tell()
+    pcap_bytes.seek(0)
+    return size
+
+
+def get_all_captures(
+    api,
+    cfg,
+    workers=None,
+    spool_bytes=None,
+    run_id=None,
+    snap_length=None,
+    flows=None,
+):
+    """
+    Returns a dictionary where port name is the key and value is a
+    CaptureStore holding all frames captured on that port, where each frame
+    is represented as a memoryview of its bytes.
+    Captures from multiple ports are fetched and parsed concurrently using
+    upto `workers` threads, which defaults to `capture_workers` setting.
+    Captures larger than `spool_bytes`, which defaults to
+    `capture_spool_bytes` setting, are spooled to disk (see
+    get_capture_store()). Spooling is disabled when neither is set.
+    When `run_id`, which defaults to `capture_run_id` setting, is set along
+    with `capture_cache_dir` setting, pcap bytes are cached on disk against
+    config, port name and run id (see get_capture_cache()), so that a rerun
+    with same run id is served from cache instead of the controller.
+    Frames are truncated to `snap_length` bytes, which defaults to
+    `capture_snap_length` setting, while their original lengths are kept
+    (see CaptureStore.wire_lengths), so that header validation of large
+    captures needs a fraction of memory.
+    When `flows` are given, only captures of ports transmitting or receiving
+    those flows are fetched (see get_capture_port_names()).
+    """
+    names = get_capture_port_names(cfg, flows)
+    if workers is None:
+        workers = int(getattr(settings, "capture_workers", None) or 1)
+    workers = max(1, min(workers, len(names)))
+    if spool_bytes is None:
+        spool_bytes = getattr(settings, "capture_spool_bytes", None)
+    if spool_bytes is not None:
+        spool_bytes = int(spool_bytes)
+    if run_id is None:
+        run_id = getattr(settings, "capture_run_id", None)
+    cache = None if run_id is None else get_capture_cache()
+    if snap_length is None:
+        snap_length = getattr(settings, "capture_snap_length", None)
+    if snap_length is not None:
+        snap_length = int(snap_length)
+
+    cap_dict = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for name in names:
+            key = None
+            if cache is not None:
+                key = capture_cache_key(cfg, name, run_id)
+            future = executor.submit(
+                get_capture_store,
+                api,
+                name,
+                spool_bytes,
+                cache,
+                key,
+                snap_length,
+            )
+            futures[future] = name
+        for future in as_completed(futures):
+            name = futures[future]
+            cap_dict[name], download, parse = future.result()
+            print(
+                "Fetched %d frames from port %s (download %.3fs, parse %.3fs)"
+                % (len(cap_dict[name]), name, download, parse)
+            )
+
+    # preserve order in which capture ports are configured
+    return {name: cap_dict[name] for name in names}
 
 
-def get_capture_port_names(cfg):
+def get_capture_cache():
     """
-    Returns name of ports for which capture is enabled.
+    Returns CaptureCache rooted at `capture_cache_dir` setting and bounded
+    by `capture_cache_bytes` setting, or None when caching is disabled.
     """
+    directory = getattr(settings, "capture_cache_dir", None)
+    if not directory:
+        return None
+    max_bytes = getattr(settings, "capture_cache_bytes", None)
+    if max_bytes is not None:
+        max_bytes = int(max_bytes)
+    if directory not in CAPTURE_CACHES:
+        CAPTURE_CACHES[directory] = CaptureCache(directory, max_bytes)
+    cache = CAPTURE_CACHES[directory]
+    cache.max_bytes = max_bytes
+    return cache
+
+
+def capture_cache_key(cfg, port_name, run_id):
+    """
+    Returns content address of captures of given port, derived from hash of
+    serialized config, port name and run id.
+    """
+    digest = hashlib.sha256()
+    for part in (cfg.serialize(), port_name, str(run_id)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get_capture_port_names(cfg, flows=None):
+    """
+    Returns name of ports for which capture is enabled. When port flows are
+    given, only ports transmitting or receiving any of them are returned,
+    i.e. both ends of those flows.
+    """
+    ends = None
+    if flows is not None:
+        ends = []
+        for flow in flows:
+            tx_name, rx_names = flow_port_names(flow)
+            ends += [tx_name] + rx_names
     names = []
     for cap in cfg.captures:
         if cap._properties.get("port_names"):
             for name in cap.port_names:
-                if name not in names:
-                    names.append(name)
+                if name in names or (ends is not None and name not in ends):
+                    continue
+                names.append(name)
 
     return names
 
 
+def add_flow_captures(cfg, flows=None):
+    """
+    Enables capture on transmit and receive ports of given port flows (all
+    flows of config by default) which are not being captured yet, so that
+    both ends of the flows are captured (e.g. for flow_latency()).
+    Returns name of ports capture is enabled on.
+    """
+    if flows is None:
+        flows = cfg.flows
+    names = get_capture_port_names(cfg)
+    added = []
+    for flow in flows:
+        tx_name, rx_names = flow_port_names(flow)
+        for name in [tx_name] + rx_names:
+            if name not in names and name not in added:
+                added.append(name)
+    if added:
+        # pick a capture name not taken by captures already configured
+        taken = set(cap.name for cap in cfg.captures)
+        index = len(cfg.captures) + 1
+        while "c%d" % index in taken:
+            index += 1
+        cap = cfg.captures.capture(name="c%d" % index)[-1]
+        cap.port_names = added
+    return added
+
+
 def mac_or_ip_to_num(mac_or_ip_addr, mac=True):
     """
     Example:
@@ -0,0 +1,244 @@
+import os
+import re
+
+import numpy as np
+
+from .analysis import ETHER_TYPE_IPV4, ETHER_TYPE_IPV6, ETHER_TYPE_VLAN
+from .analysis import IP_PROTO_TCP, IP_PROTO_UDP
+
+
+# number of leading bytes of each frame decoded into columns, enough to hold
+# ethernet with two VLAN tags, IPv6, UDP and VXLAN headers
+HEADER_WINDOW = 14 + 8 + 40 + 8 + 8
+# number of frames whose header bytes are gathered at a time
+DECODE_CHUNK = 1 << 16
+VXLAN_PORT = 4789
+# IPv4 addresses are held as IPv4-mapped IPv6 addresses in IP columns
+IPV4_MAPPED_PREFIX = np.array([[0] * 10 + [0xFF, 0xFF]], dtype=np.uint8)
+
+
+def header_window(store, width=HEADER_WINDOW):
+    """
+    Returns 2-D uint8 array holding first `width` bytes of each frame of
+    given CaptureStore, where bytes past the end of shorter frames are 0.
+    """
+    lengths = np.frombuffer(store.lengths, dtype=np.uint64)
+    offsets = np.frombuffer(store.offsets, dtype=np.uint64)
+    buf = np.frombuffer(store.data, dtype=np.uint8)
+    count = len(offsets)
+    window = np.zeros((count, width), dtype=np.uint8)
+    cols = np.arange(width, dtype=np.uint64)
+    first = 0
+    if count > 1:
+        start = int(offsets[0])
+        stride = (int(offsets[-1]) - start) // (count - 1)
+        if np.array_equal(
+            offsets, start + np.arange(count, dtype=np.uint64) * stride
+        ):
+            # evenly spaced frames (e.g. fixed size frames) are copied
+            # through a strided view of the buffer instead of gathering each
+            # byte, except trailing ones whose window spans past the buffer
+            first = min(
+                count, max(0, (len(buf) - width - start) // stride + 1)
+            )
+            window[:first] = np.lib.stride_tricks.as_strided(
+                buf[start:], shape=(first, width), strides=(stride, 1)
+            )
+            short = lengths[:first, None] <= cols
+            window[:first][short] = 0
+    for i in range(first, count, DECODE_CHUNK):
+        stop = min(i + DECODE_CHUNK, count)
+        valid = cols < lengths[i:stop, None]
+        index = np.where(valid, offsets[i:stop, None] + cols, 0)
+        window[i:stop] = np.where(valid, buf[index], 0)
+    return window
+
+
+def gather(window, starts, width):
+    """
+    Returns `width` bytes of each row of window starting at column given
+    for that row in `starts`, as a 2-D uint8 array. Bytes past the end of
+    window are 0.
+    """
+    if len(starts) > 0 and (starts == starts[0]).all():
+        # same columns of all rows, e.g. frames without VLAN tags
+        start = int(starts[0])
+        size = max(0, min(width, window.shape[1] - start))
+        end = start + size
+        fields = np.zeros((len(window), width), dtype=window.dtype)
+        fields[:, :size] = window[:, start:end]
+        return fields
+    cols = starts[:, None] + np.arange(width)
+    valid = cols < window.shape[1]
+    rows = np.arange(len(window))[:, None]
+    return np.where(valid, window[rows, np.where(valid, cols, 0)], 0)
+
+
+def to_uint(fields):
+    """
+    Converts 2-D array of big endian fields (upto 8 bytes wide) to uint64.
+    """
+    value = np.zeros(len(fields), dtype=np.uint64)
+    for i in range(fields.shape[1]):
+        value = (value << np.uint64(8)) | fields[:, i].astype(np.uint64)
+    return value
+
+
+def l3_offsets(window):
+    """
+    Returns offsets of layer 3 header and ether types (after upto two VLAN
+    tags) of frames whose leading bytes are held by given header window.
+    """
+    l3 = np.full(len(window), 14, dtype=np.int64)
+    ether_type = to_uint(window[:, 12:14])
+    for _ in range(2):
+        tagged = np.isin(ether_type, ETHER_TYPE_VLAN)
+        l3[tagged] += 4
+        ether_type[tagged] = to_uint(gather(window, l3 - 2, 2))[tagged]
+    return l3, ether_type
+
+
+def l4_offsets(window, l3, ether_type):
+    """
+    Returns (ipv4, ipv6, protocol, l4) of frames whose leading bytes are
+    held by given header window, given their layer 3 offsets and ether
+    types (see l3_offsets()), where ipv4 and ipv6 mark frames whose ether
+    type and IP version agree, protocol is IPv4 protocol / IPv6 next header
+    (0 for non IP frames) and l4 is offset of layer 4 header.
+    """
+    first = gather(window, l3, 1)[:, 0]
+    version = first >> 4
+    ipv4 = (ether_type == ETHER_TYPE_IPV4) & (version == 4)
+    ipv6 = (ether_type == ETHER_TYPE_IPV6) & (version == 6)
+    ihl = (first & 0x0F).astype(np.int64) * 4
+    protocol = np.where(
+        ipv4,
+        gather(window, l3 + 9, 1)[:, 0],
+        np.where(ipv6, gather(window, l3 + 6, 1)[:, 0], 0),
+    ).astype(np.int64)
+    l4 = np.where(ipv4, l3 + ihl, l3 + 40)
+    return ipv4, ipv6, protocol, l4
+
+
+def decode_columns(store):
+    """
+    Decodes frames of given CaptureStore into a dictionary of columns, i.e.
+    numpy arrays with one entry per frame, without looping over frames.
+    - ts, length: timestamp (in nanoseconds) and original length of frame
+    - dst_mac, src_mac: MAC addresses as integers
+    - ether_type: ether type after (upto two) VLAN tags
+    - ip_version: 4 or 6, 0 for non IP frames
+    - src_ip, dst_ip: 16 byte addresses, where IPv4 addresses are mapped
+      to IPv6 (i.e. ::ffff:a.b.c.d), all zeros for non IP frames
+    - protocol: IPv4 protocol / IPv6 next header
+    - src_port, dst_port: TCP or UDP ports, 0 for other protocols
+    - vni: VXLAN network identifier, -1 when frame is not VXLAN
+    """
+    window = header_window(store)
+    count = len(window)
+    columns = {
+        "ts": np.frombuffer(store.timestamps, dtype=np.uint64).copy(),
+        "length": np.frombuffer(store.wire_lengths, dtype=np.uint64).copy(),
+        "dst_mac": to_uint(window[:, 0:6]),
+        "src_mac": to_uint(window[:, 6:12]),
+    }
+
+    l3, ether_type = l3_offsets(window)
+    columns["ether_type"] = ether_type.astype(np.uint16)
+
+    ipv4, ipv6, protocol, l4 = l4_offsets(window, l3, ether_type)
+    columns["ip_version"] = np.where(ipv4, 4, np.where(ipv6, 6, 0)).astype(
+        np.uint8
+    )
+    columns["protocol"] = protocol.astype(np.uint8)
+
+    for name, v4, v6 in (("src_ip", 12, 8), ("dst_ip", 16, 24)):
+        mapped = np.hstack(
+            [
+                np.repeat(IPV4_MAPPED_PREFIX, count, axis=0),
+                gather(window, l3 + v4, 4),
+            ]
+        )
+        addr = np.where(ipv4[:, None], mapped, 0)
+        addr = np.where(ipv6[:, None], gather(window, l3 + v6, 16), addr)
+        columns[name] = addr.astype(np.uint8)
+
+    has_ports = (ipv4 | ipv6) & np.isin(protocol, (IP_PROTO_TCP, IP_PROTO_UDP))
+    ports = to_uint(gather(window, l4, 4))
+    src_port = np.where(has_ports, ports >> np.uint64(16), 0)
+    dst_port = np.where(has_ports, ports & np.uint64(0xFFFF), 0)
+    columns["src_port"] = src_port.astype(np.uint16)
+    columns["dst_port"] = dst_port.astype(np.uint16)
+
+    vxlan = has_ports & (protocol == IP_PROTO_UDP) & (dst_port == VXLAN_PORT)
+    vni = to_uint(gather(window, l4 + 12, 3)).astype(np.int64)
+    columns["vni"] = np.where(vxlan, vni, -1)
+    return columns
+
+
+def write_columns(columns, path):
+    """
+    Writes columns (see decode_columns()) to given path, in a format based
+    on its extension, i.e. NumPy .npz (loaded back using numpy.load()), or
+    Parquet (.parquet) and Arrow IPC (.arrow or .feather), which need
+    pyarrow to be installed.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npz":
+        np.savez_compressed(path, **columns)
+        return
+    if ext not in (".parquet", ".arrow", ".feather"):
+        raise Exception("Unsupported columnar format %s" % ext)
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise Exception("pyarrow needs to be installed to write %s" % path)
+    arrays = []
+    for name, column in columns.items():
+        if column.ndim == 2:
+            # byte arrays (e.g. IP addresses) become fixed size binary
+            arrays.append(
+                pa.FixedSizeBinaryArray.from_buffers(
+                    pa.binary(column.shape[1]),
+                    len(column),
+                    [None, pa.py_buffer(np.ascontiguousarray(column))],
+                )
+            )
+        else:
+            arrays.append(pa.array(column))
+    table = pa.Table.from_arrays(arrays, names=list(columns))
+    if ext == ".parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, path)
+    else:
+        import pyarrow.feather as feather
+
+        feather.write_feather(table, path)
+
+
+def export_all_captures(cap_dict, directory, ext=".npz"):
+    """
+    Decodes captures returned by get_all_captures() and writes them to
+    given directory as one columnar file per port, named after the port.
+    Returns a dictionary of port name and path of written file.
+    Usage
+    -----
+    ```
+    cap_dict = get_all_captures(api, cfg)
+    paths = export_all_captures(cap_dict, "captures")
+    columns = numpy.load(paths["rx"])
+    ```
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = {}
+    for name, store in cap_dict.items():
+        path = os.path.join(directory, re.sub(r"[^\w.-]", "_", name) + ext)
+        write_columns(decode_columns(store), path)
+        print(
+            "Exported %d frames from port %s to %s" % (len(store), name, path)
+        )
+        paths[name] = path
+    return paths
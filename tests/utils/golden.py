@@ -0,0 +1,387 @@
+import mmap
+import os
+import re
+
+import numpy as np
+
+from .analysis import IP_PROTO_TCP, IP_PROTO_UDP
+from .capture import load_capture, write_pcap
+from .checksum import L4_CHECKSUM_OFFSET
+from .common import settings
+from .export import gather, header_window, l3_offsets, l4_offsets
+
+
+# fields whose values may differ between runs of same traffic, which are
+# masked (i.e. zeroed) before hashing frames by default, where payload
+# (i.e. bytes following innermost known header, up to and including FCS)
+# carries instrumentation of flows with metrics (e.g. timestamps and
+# sequence numbers) and hence differs as well
+VOLATILE_FIELDS = (
+    "ipv4.identification",
+    "ipv4.header_checksum",
+    "tcp.checksum",
+    "udp.checksum",
+    "payload",
+)
+# number of frame bytes gathered at a time for hashing
+HASH_CHUNK = 1 << 22
+# 64 bit FNV offset basis and prime, combining words of a frame mixed by
+# finalizer of 64 bit MurmurHash3 (using its two multipliers)
+HASH_SEED = np.uint64(0xCBF29CE484222325)
+HASH_PRIME = np.uint64(0x100000001B3)
+HASH_MIX = (np.uint64(0xFF51AFD7ED558CCD), np.uint64(0xC4CEB9FE1A85EC53))
+
+
+def volatile_ranges(store, fields):
+    """
+    Returns list of (starts, ends) locating given fields in each frame of
+    a CaptureStore, where starts and ends hold offsets of field in each
+    frame, -1 for frames not carrying the field. Fields are either names
+    listed in VOLATILE_FIELDS or (start, end) byte ranges of all frames.
+    """
+    count = len(store)
+    window = header_window(store)
+    l3, ether_type = l3_offsets(window)
+    ipv4, ipv6, protocol, l4 = l4_offsets(window, l3, ether_type)
+    ip = ipv4 | ipv6
+
+    def located(carried, start, width):
+        starts = np.where(carried, start, -1)
+        return starts, np.where(carried, starts + width, -1)
+
+    ranges = []
+    for field in fields:
+        if not isinstance(field, str):
+            start, end = field
+            ranges.append(
+                (
+                    np.full(count, start, dtype=np.int64),
+                    np.full(count, end, dtype=np.int64),
+                )
+            )
+        elif field == "ipv4.identification":
+            ranges.append(located(ipv4, l3 + 4, 2))
+        elif field == "ipv4.header_checksum":
+            ranges.append(located(ipv4, l3 + 10, 2))
+        elif field in ("tcp.checksum", "udp.checksum"):
+            proto = IP_PROTO_TCP if field == "tcp.checksum" else IP_PROTO_UDP
+            offset = L4_CHECKSUM_OFFSET[proto]
+            ranges.append(located(ip & (protocol == proto), l4 + offset, 2))
+        elif field == "payload":
+            # TCP header length is held by its data offset nibble
+            tcp_length = gather(window, l4 + 12, 1)[:, 0].astype(np.int64)
+            tcp_length = (tcp_length >> 4) * 4
+            start = np.where(ip, l4, l3)
+            start = np.where(ip & (protocol == IP_PROTO_UDP), l4 + 8, start)
+            start = np.where(
+                ip & (protocol == IP_PROTO_TCP), l4 + tcp_length, start
+            )
+            end = np.frombuffer(store.lengths, dtype=np.uint64)
+            ranges.append((start, end.astype(np.int64)))
+        else:
+            raise Exception("Masking %s is not supported" % field)
+    return ranges
+
+
+def mix(values):
+    """
+    Returns given uint64 array with bits of each value avalanched, so that
+    a change in any bit changes about half of the bits of result.
+    """
+    shift = np.uint64(33)
+    values = values ^ (values >> shift)
+    for multiplier in HASH_MIX:
+        values *= multiplier
+        values ^= values >> shift
+    return values
+
+
+def hash_rows(words, seeds):
+    """
+    Returns 64 bit hash of each row of given 2-D uint64 array, starting
+    from given per row seeds.
+    Each word is mixed before it is combined, and the state is folded after
+    each multiplication, since multiplying never carries a bit into lower
+    bits, e.g. flips of top bit of two unmixed words would cancel.
+    """
+    hashes = HASH_SEED ^ seeds
+    fold = np.uint64(32)
+    for col in range(words.shape[1]):
+        hashes ^= mix(words[:, col])
+        hashes *= HASH_PRIME
+        hashes ^= hashes >> fold
+    return mix(hashes)
+
+
+def frame_hashes(store, mask=VOLATILE_FIELDS):
+    """
+    Returns uint64 array holding hash of captured bytes and original length
+    of each frame of given CaptureStore, where bytes of fields in `mask`
+    (see volatile_ranges()) are zeroed before hashing. Timestamps are not
+    part of frame bytes, hence never hashed.
+    Frames of same length are hashed together, a chunk of rows at a time,
+    so that hashing takes a vectorized step per 8 bytes of frame instead of
+    a step per frame.
+    """
+    count = len(store)
+    hashes = np.zeros(count, dtype=np.uint64)
+    if count == 0:
+        return hashes
+    buf = np.frombuffer(store.data, dtype=np.uint8)
+    offsets = np.frombuffer(store.offsets, dtype=np.uint64).astype(np.int64)
+    lengths = np.frombuffer(store.lengths, dtype=np.uint64).astype(np.int64)
+    wire_lengths = np.frombuffer(store.wire_lengths, dtype=np.uint64)
+    ranges = volatile_ranges(store, mask or ())
+
+    for length in np.unique(lengths).tolist():
+        same = np.flatnonzero(lengths == length)
+        cols = np.arange(length, dtype=np.int64)
+        width = (length + 7) // 8 * 8
+        step = max(1, HASH_CHUNK // max(length, 1))
+        for start in range(0, len(same), step):
+            end = start + step
+            rows = same[start:end]
+            data = np.zeros((len(rows), width), dtype=np.uint8)
+            first = offsets[rows[0]]
+            spacing = np.diff(offsets[rows])
+            stride = int(spacing[0]) if len(spacing) else 0
+            if stride > 0 and (spacing == stride).all():
+                # frames laid out back to back are copied through a strided
+                # view of the buffer instead of gathering each byte
+                data[:, :length] = np.lib.stride_tricks.as_strided(
+                    buf[first:],
+                    shape=(len(rows), length),
+                    strides=(stride, 1),
+                )
+            else:
+                data[:, :length] = buf[offsets[rows, None] + cols]
+            for starts, ends in ranges:
+                starts, ends = starts[rows], ends[rows]
+                if (starts == starts[0]).all() and (ends == ends[0]).all():
+                    # same bytes of all rows, e.g. frames of same flow
+                    low, high = int(starts[0]), min(int(ends[0]), length)
+                    if low >= 0:
+                        data[:, low:high] = 0
+                    continue
+                masked = (cols >= starts[:, None]) & (cols < ends[:, None])
+                data[:, :length][masked] = 0
+            hashes[rows] = hash_rows(data.view("<u8"), wire_lengths[rows])
+    return hashes
+
+
+def occurrences(hashes):
+    """
+    Returns (order, sorted hashes, ranks) where order sorts given hashes
+    and rank of each sorted hash is the number of equal hashes preceding
+    it, so that repeated frames are paired in order of their occurrence.
+    """
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    first = np.searchsorted(sorted_hashes, sorted_hashes, side="left")
+    return order, sorted_hashes, np.arange(len(order)) - first
+
+
+def pair_hashes(first, second):
+    """
+    Joins two arrays of frame hashes (or any uint64 keys), pairing k-th
+    occurrence of a hash in first array with k-th occurrence of that hash
+    in second array. Returns (indices into first, indices into second,
+    unique) of pairs ordered by index into second, where unique marks pairs
+    whose hash occurs once in each array.
+    """
+    first_order, first_hashes, first_ranks = occurrences(first)
+    second_order, second_hashes, second_ranks = occurrences(second)
+
+    # after sorting by hash and rank, a frame of first array immediately
+    # followed by a frame of second array with same hash and rank is a pair
+    index = np.concatenate((first_order, second_order))
+    hashes = np.concatenate((first_hashes, second_hashes))
+    ranks = np.concatenate((first_ranks, second_ranks))
+    sides = np.concatenate(
+        (np.zeros(len(first), np.int8), np.ones(len(second), np.int8))
+    )
+    merged = np.lexsort((sides, ranks, hashes))
+    index, hashes = index[merged], hashes[merged]
+    ranks, sides = ranks[merged], sides[merged]
+    same = (hashes[:-1] == hashes[1:]) & (ranks[:-1] == ranks[1:])
+    pairs = np.flatnonzero(same & (sides[:-1] == 0))
+    first_index, second_index = index[pairs], index[pairs + 1]
+    # hashes occurring once in each array form groups of two
+    changes = np.flatnonzero(hashes[1:] != hashes[:-1]) + 1
+    sizes = np.diff(np.concatenate(([0], changes, [len(hashes)])))
+    unique = np.repeat(sizes, sizes)[pairs] == 2
+
+    order = np.argsort(second_index, kind="stable")
+    return first_index[order], second_index[order], unique[order]
+
+
+class CaptureDiff(object):
+    """
+    Outcome of diff_captures() comparing a capture against a golden one,
+    where all indices are positions of frames in respective capture.
+    - matched: (golden indices, indices) of frames found in both
+    - missing: golden frames not found in capture
+    - added: frames of capture not found in golden capture
+    - reordered: matched frames of capture arriving after a frame which
+      follows them in golden capture, among frames occurring once in both
+      captures (repeated frames are paired in order of occurrence)
+    """
+
+    def __init__(self, golden_frames, frames):
+        self.golden_frames = golden_frames
+        self.frames = frames
+        empty = np.empty(0, dtype=np.int64)
+        self.matched = (empty, empty)
+        self.missing = empty
+        self.added = empty
+        self.reordered = empty
+
+    def ok(self):
+        differences = (self.missing, self.added, self.reordered)
+        return all(len(d) == 0 for d in differences)
+
+    def assert_ok(self):
+        """
+        Raises AssertionError describing differences, if any.
+        """
+        if self.ok():
+            return
+        raise AssertionError(
+            "Capture of %d frames differs from golden capture of %d frames, "
+            "%d missing (first %s), %d added (first %s), %d reordered "
+            "(first %s)"
+            % (
+                self.frames,
+                self.golden_frames,
+                len(self.missing),
+                self.missing[:10].tolist(),
+                len(self.added),
+                self.added[:10].tolist(),
+                len(self.reordered),
+                self.reordered[:10].tolist(),
+            )
+        )
+
+    def print_report(self):
+        row_format = "{:>20}{:>15}"
+        border = "-" * 35
+        print("\nGolden Capture Diff")
+        print(border)
+        print(row_format.format("Golden Frames", self.golden_frames))
+        print(row_format.format("Frames", self.frames))
+        print(row_format.format("Matched", len(self.matched[0])))
+        print(row_format.format("Missing", len(self.missing)))
+        print(row_format.format("Added", len(self.added)))
+        print(row_format.format("Reordered", len(self.reordered)))
+        print(border)
+        print("")
+
+
+def diff_captures(store, golden, mask=VOLATILE_FIELDS):
+    """
+    Compares frames of a CaptureStore against those of a golden
+    CaptureStore and returns a CaptureDiff. Frames are hashed (see
+    frame_hashes()) and aligned by sorting hashes of both captures, hence
+    frames are never compared one at a time in Python.
+    Usage
+    -----
+    ```
+    diff = diff_captures(cap_dict["rx"], load_golden("rx.pcap"))
+    diff.print_report()
+    diff.assert_ok()
+    ```
+    """
+    result = CaptureDiff(len(golden), len(store))
+    golden_index, new_index, unique = pair_hashes(
+        frame_hashes(golden, mask), frame_hashes(store, mask)
+    )
+    result.matched = (golden_index, new_index)
+    # repeated frames are indistinguishable, hence order of their pairing
+    # says nothing about reordering, which is looked for among unique ones
+    golden_unique = golden_index[unique]
+    new_unique = new_index[unique]
+    if len(golden_unique) > 0:
+        highest = np.maximum.accumulate(golden_unique)
+        late = np.concatenate(([False], golden_unique[1:] < highest[:-1]))
+        result.reordered = new_unique[late]
+
+    found = np.zeros(len(golden), dtype=bool)
+    found[golden_index] = True
+    result.missing = np.flatnonzero(~found)
+    found = np.zeros(len(store), dtype=bool)
+    found[new_index] = True
+    result.added = np.flatnonzero(~found)
+    return result
+
+
+def load_golden(path):
+    """
+    Returns a CaptureStore indexing frames of given golden pcap or pcapng
+    file in place, through a read only memory map.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return load_capture(mapped)
+
+
+def golden_path(name, directory):
+    """
+    Returns path of golden pcap recorded under given name in given directory.
+    """
+    return os.path.join(directory, re.sub(r"[^\w.-]", "_", name) + ".pcap")
+
+
+def record_golden(store, name, directory=None):
+    """
+    Records frames of given CaptureStore as golden capture under `name` in
+    given directory, which defaults to `capture_golden_dir` setting, and
+    returns path of recorded pcap.
+    """
+    if directory is None:
+        directory = getattr(settings, "capture_golden_dir", None)
+    if not directory:
+        raise Exception("No directory is set for golden captures")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = golden_path(name, directory)
+    write_pcap(store, path)
+    print("Recorded %d frames as golden capture %s" % (len(store), path))
+    return path
+
+
+def check_golden(
+    store, name, directory=None, mask=VOLATILE_FIELDS, record=None
+):
+    """
+    Diffs given CaptureStore against golden capture recorded under `name`
+    in given directory, which defaults to `capture_golden_dir` setting, and
+    returns a CaptureDiff, or None when no directory is set.
+    Golden captures are only recorded on request, i.e. when `record` (which
+    defaults to `capture_golden_record` setting) is true, in which case
+    frames of store are recorded in place of any earlier golden capture and
+    None is returned. A golden capture missing otherwise is an error.
+    Usage
+    -----
+    ```
+    diff = check_golden(cap_dict["rx"], "test_counter_tcp_ports_rx")
+    if diff is not None:
+        diff.assert_ok()
+    ```
+    """
+    if directory is None:
+        directory = getattr(settings, "capture_golden_dir", None)
+    if not directory:
+        return None
+    if record is None:
+        record = getattr(settings, "capture_golden_record", None)
+    # settings passed on command line are strings
+    if str(record).lower() == "true":
+        record_golden(store, name, directory)
+        return None
+    path = golden_path(name, directory)
+    if not os.path.exists(path):
+        raise Exception(
+            "Golden capture %s is not recorded, it can be recorded by "
+            "running with --capture_golden_record true" % path
+        )
+    return diff_captures(store, load_golden(path), mask)
@@ -0,0 +1,186 @@
+import numpy as np
+
+from .golden import VOLATILE_FIELDS, frame_hashes, pair_hashes
+from .patterns import flow_port_names
+from .sequence import SIGNATURE_LENGTH
+from .validate import capture_array
+
+
+# latency percentiles reported by measure_latency()
+LATENCY_PERCENTILES = (50, 99, 99.9)
+# fields masked before hashing frames to match transmitted and received
+# ones, where payload is left in, since both ends see same payload and its
+# instrumentation tells apart frames of a flow carrying identical headers
+LATENCY_MASK = tuple(f for f in VOLATILE_FIELDS if f != "payload")
+
+
+class LatencyStats(object):
+    """
+    One-way latency of a group of received frames (e.g. a flow) matched
+    with transmitted frames, where all times are in nanoseconds.
+    - frames: number of received frames matched with a transmitted frame
+    - unmatched: number of received frames not found among transmitted ones
+    - latencies: latency of each matched frame, in order of arrival
+    - percentiles: percentile -> latency
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.unmatched = 0
+        self.latencies = np.empty(0, dtype=np.int64)
+        self.min = None
+        self.max = None
+        self.mean = None
+        self.percentiles = {}
+
+
+def frame_keys(store, offset=None, mask=LATENCY_MASK):
+    """
+    Returns uint64 key of each frame of given CaptureStore used to match
+    transmitted and received frames, i.e. signature embedded at `offset`
+    (see add_sequence_signature()) when provided, hash of frame otherwise
+    (see frame_hashes()), in which case received frames differing from
+    transmitted ones outside of masked fields are left unmatched.
+    """
+    if offset is None:
+        return frame_hashes(store, mask)
+    end = offset + SIGNATURE_LENGTH
+    frames, _ = capture_array(store, end)
+    signatures = np.ascontiguousarray(frames[:, offset:end])
+    return signatures.view(np.uint64).ravel()
+
+
+def measure_latency(
+    tx_store,
+    rx_store,
+    offset=None,
+    buckets=None,
+    names=None,
+    mask=LATENCY_MASK,
+):
+    """
+    Matches frames captured on receiving port (rx_store) with frames
+    captured on transmitting port (tx_store) by their keys (see
+    frame_keys()), using a sort based join of key arrays rather than a
+    lookup per frame, and returns list of LatencyStats, one per group of
+    received frames as given by `buckets` and `names` (see
+    analyze_timing()). All received frames form a single group when
+    buckets are not provided. Repeated frames are matched in order of
+    their occurrence.
+    Transmitting port needs to capture frames it transmits (e.g. through a
+    tap or port mirror), and both ports need to be timestamped by same
+    clock, as is the case for ports of a chassis.
+    Usage
+    -----
+    ```
+    (stats,) = measure_latency(cap_dict["tx"], cap_dict["rx"])
+    assert stats.percentiles[99] < 10000
+    ```
+    """
+    tx_ts = np.frombuffer(tx_store.timestamps, dtype=np.uint64)
+    rx_ts = np.frombuffer(rx_store.timestamps, dtype=np.uint64)
+    if (tx_ts == 0).any() or (rx_ts == 0).any():
+        raise Exception("Capture does not carry timestamps of all frames")
+    if buckets is None:
+        buckets = np.zeros(len(rx_ts), dtype=np.int64)
+    buckets = np.asarray(buckets, dtype=np.int64)
+    if len(buckets) != len(rx_ts):
+        raise Exception(
+            "Got %d buckets for %d frames" % (len(buckets), len(rx_ts))
+        )
+    groups = int(buckets.max()) + 1 if len(buckets) else 0
+    if names is None:
+        names = [str(i) for i in range(groups)]
+
+    tx_index, rx_index, _ = pair_hashes(
+        frame_keys(tx_store, offset, mask), frame_keys(rx_store, offset, mask)
+    )
+    latencies = rx_ts[rx_index].astype(np.int64)
+    latencies -= tx_ts[tx_index].astype(np.int64)
+    matched_buckets = buckets[rx_index]
+    received = np.bincount(buckets[buckets >= 0], minlength=groups)
+
+    results = []
+    for group in range(groups):
+        stats = LatencyStats(names[group])
+        results.append(stats)
+        stats.latencies = latencies[matched_buckets == group]
+        stats.frames = len(stats.latencies)
+        stats.unmatched = int(received[group]) - stats.frames
+        if stats.frames == 0:
+            continue
+        stats.min = int(stats.latencies.min())
+        stats.max = int(stats.latencies.max())
+        stats.mean = float(stats.latencies.mean())
+        percentiles = np.percentile(stats.latencies, LATENCY_PERCENTILES)
+        stats.percentiles = dict(
+            zip(LATENCY_PERCENTILES, percentiles.tolist())
+        )
+    return results
+
+
+def flow_latency(cap_dict, flow, offset=None, mask=LATENCY_MASK):
+    """
+    Returns list of LatencyStats of given port flow, one per receiving
+    port, given captures of both ends of the flow (see add_flow_captures()
+    and get_all_captures()).
+    Usage
+    -----
+    ```
+    add_flow_captures(cfg)
+    start_traffic(api, cfg)
+    ...
+    cap_dict = get_all_captures(api, cfg, flows=[cfg.flows[0]])
+    print_latency(flow_latency(cap_dict, cfg.flows[0]))
+    ```
+    """
+    tx_name, rx_names = flow_port_names(flow)
+    results = []
+    for rx_name in rx_names:
+        name = "%s %s>%s" % (flow.name, tx_name, rx_name)
+        results += measure_latency(
+            cap_dict[tx_name],
+            cap_dict[rx_name],
+            offset,
+            names=[name],
+            mask=mask,
+        )
+    return results
+
+
+def print_latency(results):
+    row_format = "{:>20}{:>10}{:>10}{:>12}{:>12}{:>12}{:>12}{:>12}"
+    border = "-" * 100
+    print("\nLatency (in microseconds)")
+    print(border)
+    print(
+        row_format.format(
+            "Name",
+            "Frames",
+            "Unmatched",
+            "Min",
+            "Avg",
+            "p50",
+            "p99",
+            "p99.9",
+        )
+    )
+    for stats in results:
+        if stats.frames == 0:
+            print(row_format.format(stats.name, 0, stats.unmatched, *"-" * 5))
+            continue
+        print(
+            row_format.format(
+                stats.name,
+                stats.frames,
+                stats.unmatched,
+                "%.3f" % (stats.min / 1e3),
+                "%.3f" % (stats.mean / 1e3),
+                "%.3f" % (stats.percentiles[50] / 1e3),
+                "%.3f" % (stats.percentiles[99] / 1e3),
+                "%.3f" % (stats.percentiles[99.9] / 1e3),
+            )
+        )
+    print(border)
+    print("")
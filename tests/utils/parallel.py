@@ -0,0 +1,277 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .capture import capture_buffer, load_capture
+from .checksum import verify_checksums
+from .common import (
+    capture_cache_key,
+    fetch_capture,
+    get_capture_cache,
+    get_capture_port_names,
+    settings,
+)
+from .validate import capture_array, column_mismatches, sample_rows
+
+
+class CaptureReport(object):
+    """
+    Compact outcome of parsing and validating captures of a port in a worker
+    process, which is cheap to send back to parent process in place of the
+    frames themselves.
+    - sizes: frame size -> frames
+    - checked: number of frames validated (less than frames when sampling)
+    - mismatches: (start, end, frames, first frame, expected, actual) for
+      each failed check, where expected and actual are hex of first mismatch
+    - checksums: ChecksumResult when checksums are verified
+    """
+
+    def __init__(self, port_name):
+        self.port_name = port_name
+        self.frames = 0
+        self.bytes = 0
+        self.sizes = {}
+        self.first_ts = None
+        self.last_ts = None
+        self.checked = 0
+        self.mismatches = []
+        self.checksums = None
+        self.parse_seconds = 0
+        self.validate_seconds = 0
+        self.pid = os.getpid()
+
+    def ok(self):
+        if self.checksums is not None and not self.checksums.ok():
+            return False
+        return len(self.mismatches) == 0
+
+    def assert_ok(self):
+        """
+        Raises AssertionError describing first failed check, if any.
+        """
+        if self.ok():
+            return
+        if not self.mismatches:
+            self.checksums.assert_ok()
+        start, end, count, first, expected, actual = self.mismatches[0]
+        raise AssertionError(
+            "Bytes %d:%d of %d/%d frames on port %s are not as expected, "
+            "first at frame %d: expected %s, got %s"
+            % (
+                start,
+                end,
+                count,
+                self.checked,
+                self.port_name,
+                first,
+                expected,
+                actual,
+            )
+        )
+
+    def print_report(self):
+        row_format = "{:>20}{:>15}"
+        border = "-" * 40
+        print("\nCapture Report of port %s" % self.port_name)
+        print(border)
+        print(row_format.format("Frames", self.frames))
+        print(row_format.format("Bytes", self.bytes))
+        print(row_format.format("Checked", self.checked))
+        print(row_format.format("Failed Checks", len(self.mismatches)))
+        if self.checksums is not None:
+            checksums = self.checksums
+            print(row_format.format("Bad IPv4 Sums", len(checksums.ip_errors)))
+            print(row_format.format("Bad L4 Sums", len(checksums.l4_errors)))
+        print(row_format.format("Parse (s)", "%.3f" % self.parse_seconds))
+        print(
+            row_format.format("Validate (s)", "%.3f" % self.validate_seconds)
+        )
+        print(border)
+        print(row_format.format("Frame Size", "Frames"))
+        for size in sorted(self.sizes):
+            print(row_format.format(size, self.sizes[size]))
+        print(border)
+        print("")
+
+
+def report_buffer(port_name, buf, checks=None, checksums=False):
+    """
+    Parses pcap or pcapng bytes of given buffer and validates its frames
+    against checks (see validate_columns()) and checksums (see
+    verify_checksums()) when asked, returning a CaptureReport.
+    """
+    report = CaptureReport(port_name)
+    start = time.time()
+    store = load_capture(buf)
+    report.parse_seconds = time.time() - start
+
+    start = time.time()
+    report.frames = len(store)
+    if report.frames == 0:
+        return report
+    lengths = np.frombuffer(store.wire_lengths, dtype=np.uint64)
+    timestamps = np.frombuffer(store.timestamps, dtype=np.uint64)
+    report.bytes = int(lengths.sum())
+    sizes, counts = np.unique(lengths, return_counts=True)
+    report.sizes = {int(s): int(c) for s, c in zip(sizes, counts)}
+    known = timestamps[timestamps > 0]
+    if len(known) > 0:
+        report.first_ts, report.last_ts = int(known.min()), int(known.max())
+
+    if checks:
+        frames, _ = capture_array(store)
+        rows = sample_rows(len(frames))
+        report.checked = len(frames) if rows is None else len(rows)
+        for field_start, field_end, values in checks:
+            bad = column_mismatches(
+                frames, field_start, field_end, values, rows
+            )
+            if len(bad) == 0:
+                continue
+            first = int(bad[0])
+            report.mismatches.append(
+                (
+                    field_start,
+                    field_end,
+                    len(bad),
+                    first,
+                    bytes(bytearray(values[first % len(values)])).hex(),
+                    bytes(frames[first, field_start:field_end]).hex(),
+                )
+            )
+    if checksums:
+        report.checksums = verify_checksums(store)
+    report.validate_seconds = time.time() - start
+    return report
+
+
+def report_shared_capture(
+    port_name, shm_name, size, checks=None, checksums=False
+):
+    """
+    Runs report_buffer() in a worker process over pcap bytes placed in
+    shared memory block of given name by parent process.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        return report_buffer(port_name, shm.buf[:size], checks, checksums)
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            # a view of the block is still referenced by traceback of a
+            # failed report, it's unmapped when worker exits
+            pass
+
+
+def share_buffer(buf):
+    """
+    Returns a new shared memory block holding a copy of given buffer.
+    """
+    size = len(buf)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    shm.buf[:size] = buf
+    return shm
+
+
+def report_captures(buffers, checks=None, processes=None, checksums=False):
+    """
+    Returns a dictionary where port name is the key and value is a
+    CaptureReport, given an iterable of (port name, pcap buffer).
+    Each buffer is copied to shared memory and parsed and validated in a
+    pool of upto `processes` worker processes, which defaults to
+    `capture_processes` setting or number of CPUs. Checks may either be a
+    list applied to all ports or a dictionary of such lists keyed by port
+    name. Checksums of all frames are verified as well when `checksums` is
+    true. Buffers are consumed lazily, hence a generator downloading
+    captures keeps downloads overlapped with decoding of previous ports.
+    """
+    if processes is None:
+        processes = getattr(settings, "capture_processes", None)
+    processes = max(1, int(processes or os.cpu_count() or 1))
+
+    blocks = []
+    reports = {}
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {}
+            for name, buf in buffers:
+                shm = share_buffer(buf)
+                blocks.append(shm)
+                port_checks = checks
+                if isinstance(checks, dict):
+                    port_checks = checks.get(name)
+                future = executor.submit(
+                    report_shared_capture,
+                    name,
+                    shm.name,
+                    len(buf),
+                    port_checks,
+                    checksums,
+                )
+                futures[future] = name
+            for future in as_completed(futures):
+                report = future.result()
+                reports[report.port_name] = report
+                print(
+                    "Validated %d frames from port %s in process %d "
+                    "(parse %.3fs, validate %.3fs)"
+                    % (
+                        report.frames,
+                        report.port_name,
+                        report.pid,
+                        report.parse_seconds,
+                        report.validate_seconds,
+                    )
+                )
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return reports
+
+
+def validate_all_captures(
+    api, cfg, checks=None, processes=None, run_id=None, checksums=False
+):
+    """
+    Process pool counterpart of get_all_captures(), which parses and
+    validates captures of all ports in parallel and returns a dictionary
+    where port name is the key and value is a CaptureReport (see
+    report_captures()). Captures are served from cache as in
+    get_all_captures().
+    Usage
+    -----
+    ```
+    reports = validate_all_captures(api, cfg, compile_flow(cfg.flows[0]))
+    for report in reports.values():
+        report.assert_ok()
+        assert report.sizes == {size: packets}
+    ```
+    """
+    names = get_capture_port_names(cfg)
+    if run_id is None:
+        run_id = getattr(settings, "capture_run_id", None)
+    cache = None if run_id is None else get_capture_cache()
+
+    def buffers():
+        for name in names:
+            buf = None
+            if cache is not None:
+                key = capture_cache_key(cfg, name, run_id)
+                buf = cache.load(key)
+            if buf is not None:
+                print("Serving captures of port %s from cache" % name)
+            else:
+                pcap_bytes = fetch_capture(api, name)
+                if cache is not None:
+                    cache.put(key, pcap_bytes)
+                buf = capture_buffer(pcap_bytes)
+            yield name, buf
+
+    reports = report_captures(buffers(), checks, processes, checksums)
+    # preserve order in which capture ports are configured
+    return {name: reports[name] for name in names}
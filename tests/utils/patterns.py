@@ -0,0 +1,379 @@
+import json
+import socket
+import struct
+
+
+# length of supported headers along with offset and width (in bytes) of
+# their byte aligned fields, as named in snappi flow packet config
+HEADERS = {
+    "ethernet": (
+        14,
+        {"dst": (0, 6), "src": (6, 6), "ether_type": (12, 2)},
+    ),
+    "vlan": (4, {"tpid": (2, 2)}),
+    "ipv4": (
+        20,
+        {
+            "total_length": (2, 2),
+            "identification": (4, 2),
+            "time_to_live": (8, 1),
+            "protocol": (9, 1),
+            "src": (12, 4),
+            "dst": (16, 4),
+        },
+    ),
+    "ipv6": (
+        40,
+        {
+            "payload_length": (4, 2),
+            "next_header": (6, 1),
+            "hop_limit": (7, 1),
+            "src": (8, 16),
+            "dst": (24, 16),
+        },
+    ),
+    "tcp": (
+        20,
+        {
+            "src_port": (0, 2),
+            "dst_port": (2, 2),
+            "seq_num": (4, 4),
+            "ack_num": (8, 4),
+            "window": (14, 2),
+        },
+    ),
+    "udp": (
+        8,
+        {"src_port": (0, 2), "dst_port": (2, 2), "length": (4, 2)},
+    ),
+    "vxlan": (8, {"vni": (4, 3)}),
+}
+
+# compiled patterns keyed by serialized packet config of a flow
+PATTERN_CACHE = {}
+# headers for which capture filters are derived by add_capture_filters(),
+# others are supported by few implementations if at all
+FILTER_HEADERS = ("ethernet",)
+
+# struct format characters of fields unpacked directly as integers, fields
+# of other widths (e.g. MAC, IPv6, VNI) are unpacked as bytes first
+STRUCT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def field_to_num(value, width):
+    """
+    Converts a field value as set in snappi config (e.g. integer, MAC, IPv4
+    or IPv6 address) to an integer.
+    Example:
+    field_to_num('00:00:00:00:00:01', 6) returns: 1
+    field_to_num('0.0.1.0', 4) returns: 256
+    """
+    if not isinstance(value, str):
+        return int(value)
+    if width == 6 and ":" in value:
+        return int(value.replace(":", ""), 16)
+    if width == 4 and "." in value:
+        return int.from_bytes(socket.inet_aton(value), "big")
+    if width == 16:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, value), "big")
+    return int(value, 0)
+
+
+def pattern_values(pattern, width):
+    """
+    Returns list of values a pattern (value, values, increment or decrement)
+    cycles through, each as bytes of given width. Returns None for patterns
+    whose values are not known upfront (e.g. auto).
+    """
+    choice = pattern.get("choice")
+    if choice == "value":
+        nums = [field_to_num(pattern["value"], width)]
+    elif choice == "values":
+        nums = [field_to_num(v, width) for v in pattern["values"]]
+    elif choice in ("increment", "decrement"):
+        counter = pattern[choice]
+        start = field_to_num(counter["start"], width)
+        step = field_to_num(counter.get("step", 1), width)
+        if choice == "decrement":
+            step = -step
+        nums = [start + i * step for i in range(counter.get("count", 1))]
+    else:
+        return None
+
+    mask = (1 << (width * 8)) - 1
+    return [(n & mask).to_bytes(width, "big") for n in nums]
+
+
+def compile_flow(flow):
+    """
+    Returns expected patterns for header fields configured in a snappi flow
+    as a list of (start, end, values), where [start, end) is byte range of
+    the field in a frame and the i-th frame of flow is expected to carry
+    values[i % len(values)] in it. Compiled patterns can be passed as is to
+    validate_columns().
+    Usage
+    -----
+    ```
+    frames, lengths = capture_array(cap_dict["rx"])
+    validate_columns(frames, compile_flow(cfg.flows[0]))
+    ```
+    Compilation stops at first header which is not known to HEADERS since
+    offsets of subsequent headers can not be determined.
+    """
+    packet = flow.serialize(flow.DICT)["packet"]
+    key = json.dumps(packet, sort_keys=True)
+    if key not in PATTERN_CACHE:
+        PATTERN_CACHE[key] = compile_packet(packet)
+    return PATTERN_CACHE[key]
+
+
+def compile_packet(packet):
+    """
+    Returns expected patterns (see compile_flow()) for given packet config,
+    which is a list of headers as serialized in a flow.
+    """
+    checks = []
+    offset = 0
+    for header in packet:
+        name = header["choice"]
+        if name not in HEADERS:
+            break
+        length, fields = HEADERS[name]
+        for field, pattern in header.get(name, {}).items():
+            if field not in fields or not isinstance(pattern, dict):
+                continue
+            start, width = fields[field]
+            values = pattern_values(pattern, width)
+            if values is not None:
+                start += offset
+                checks.append((start, start + width, values))
+        offset += length
+
+    checks.sort(key=lambda check: check[0])
+    return checks
+
+
+def filter_value_mask(values):
+    """
+    Returns (value, mask) as hex strings for a capture filter matching all
+    given values (each as bytes of same width), where bits set in mask are
+    not compared (i.e. those differing among values), or None when mask
+    covers all bits and filter would match anything.
+    """
+    nums = [int.from_bytes(bytes(v), "big") for v in values]
+    width = len(values[0])
+    differ = 0
+    for num in nums:
+        differ |= num ^ nums[0]
+    if differ == (1 << (width * 8)) - 1:
+        return None
+    value = nums[0] & ~differ
+    return (
+        value.to_bytes(width, "big").hex(),
+        differ.to_bytes(width, "big").hex(),
+    )
+
+
+def flow_rx_names(flow):
+    """
+    Returns names of ports a port flow is received on, or None for device
+    flows, whose receiving ports are not known upfront.
+    """
+    tx_rx = flow.serialize(flow.DICT)["tx_rx"]
+    if tx_rx["choice"] != "port":
+        return None
+    port = tx_rx["port"]
+    return port.get("rx_names") or [port["rx_name"]]
+
+
+def flow_port_names(flow):
+    """
+    Returns names of ports a port flow is transmitted and received on, as
+    (tx port name, rx port names). Ports of device flows are not known
+    upfront, hence they're not supported.
+    """
+    rx_names = flow_rx_names(flow)
+    if rx_names is None:
+        raise Exception("Ports of device flow %s are not known" % flow.name)
+    return flow.tx_rx.port.tx_name, rx_names
+
+
+def add_capture_filters(cfg, headers=FILTER_HEADERS):
+    """
+    Adds filters to every capture of given config, derived from header
+    fields configured on flows received on capture ports, so that frames
+    not generated by those flows are neither captured nor downloaded.
+    A field is filtered only when values of all such flows are known (i.e.
+    value, values, increment or decrement patterns), and it's matched using
+    a mask which leaves out bits differing among those values, hence
+    filters may let through more frames than expected but never less.
+    Captures receiving device flows, or already having filters, are left as
+    is. Returns number of fields filtered.
+    Masks follow the IxNetwork convention where set bits are not compared,
+    which is yet to be verified against other implementations, hence
+    filters are only added when a test asks for them.
+    Usage
+    -----
+    ```
+    add_capture_filters(config)
+    start_traffic(api, config)
+    ```
+    """
+    for name in headers:
+        if name not in ("ethernet", "ipv4", "ipv6"):
+            raise Exception("Capture filters on %s are not supported" % name)
+
+    filtered = 0
+    for cap in cfg.captures:
+        if len(cap.filters) > 0:
+            continue
+        packets = []
+        for flow in cfg.flows:
+            rx_names = flow_rx_names(flow)
+            if rx_names is None:
+                packets = []
+                break
+            if set(rx_names) & set(cap.port_names):
+                packets.append(flow.serialize(flow.DICT).get("packet", []))
+        if not packets:
+            continue
+
+        # values of a field across flows, where first occurrence of a
+        # header in each flow is considered
+        fields = {}
+        for i, packet in enumerate(packets):
+            seen = set()
+            for header in packet:
+                name = header["choice"]
+                if name not in headers or name in seen:
+                    continue
+                seen.add(name)
+                for field, pattern in header.get(name, {}).items():
+                    if field not in HEADERS[name][1]:
+                        continue
+                    if not isinstance(pattern, dict):
+                        continue
+                    width = HEADERS[name][1][field][1]
+                    values = pattern_values(pattern, width)
+                    if values is not None:
+                        fields.setdefault((name, field), [])
+                        fields[(name, field)].append((i, values))
+
+        filters = {}
+        for (name, field), per_flow in sorted(fields.items()):
+            # a field missing or unknown in any flow can't be filtered
+            if len(per_flow) != len(packets):
+                continue
+            value_mask = filter_value_mask(
+                [v for _, values in per_flow for v in values]
+            )
+            if value_mask is None:
+                continue
+            if name not in filters:
+                filters[name] = getattr(cap.filters, name)()[-1]
+            cap_field = getattr(filters[name], field)
+            cap_field.value, cap_field.mask = value_mask
+            filtered += 1
+            print(
+                "Filtering %s %s as %s (mask %s) on capture %s"
+                % (name, field, value_mask[0], value_mask[1], cap.name)
+            )
+    return filtered
+
+
+class FieldExtractor(object):
+    """
+    Extracts fields of a header layout from frames as integers, where the
+    layout is a list of headers (see HEADERS) in the order they appear in
+    frame and fields are named as "<header>.<field>". Offsets of requested
+    fields are compiled once into a single struct.Struct, hence each frame
+    is decoded by one unpack_from() call without slicing or copying it.
+    A header appearing more than once in layout (e.g. VLAN) refers to its
+    first occurrence.
+    Usage
+    -----
+    ```
+    extractor = FieldExtractor(
+        ["ethernet", "ipv4", "udp"], ["udp.src_port", "udp.dst_port"]
+    )
+    for src_port, dst_port in extractor.extract_all(cap_dict["rx"]):
+        assert src_port == 5000
+    ```
+    """
+
+    def __init__(self, headers, fields):
+        offsets = {}
+        offset = 0
+        for header in headers:
+            if header not in HEADERS:
+                raise Exception("Header %s is not supported" % header)
+            offsets.setdefault(header, offset)
+            offset += HEADERS[header][0]
+
+        spans = []
+        for i, name in enumerate(fields):
+            header, _, field = name.partition(".")
+            if header not in offsets or field not in HEADERS[header][1]:
+                raise Exception("Field %s is not present in layout" % name)
+            start, width = HEADERS[header][1][field]
+            spans.append((offsets[header] + start, width, i))
+        if not spans:
+            raise Exception("No fields to be extracted")
+        spans.sort()
+
+        fmt = ">"
+        pos = spans[0][0]
+        for start, width, _ in spans:
+            if start < pos:
+                raise Exception("Fields at offset %d overlap" % start)
+            if start > pos:
+                fmt += "%dx" % (start - pos)
+            fmt += STRUCT_FORMATS.get(width, "%ds" % width)
+            pos = start + width
+
+        self.fields = fields
+        self.offset = spans[0][0]
+        self.length = pos
+        self.struct = struct.Struct(fmt)
+        # position of each requested field among unpacked values, and of
+        # values unpacked as bytes
+        self.order = [0] * len(spans)
+        self.wide = []
+        for j, (_, width, i) in enumerate(spans):
+            self.order[i] = j
+            if width not in STRUCT_FORMATS:
+                self.wide.append(j)
+        self.simple = not self.wide and self.order == sorted(self.order)
+
+    def convert(self, values):
+        values = list(values)
+        for j in self.wide:
+            values[j] = int.from_bytes(values[j], "big")
+        return tuple(values[j] for j in self.order)
+
+    def extract(self, frame):
+        """
+        Returns tuple of requested fields, in the order they were requested,
+        from given frame (e.g. a memoryview).
+        """
+        values = self.struct.unpack_from(frame, self.offset)
+        if self.simple:
+            return values
+        return self.convert(values)
+
+    def extract_all(self, store):
+        """
+        Yields tuple of requested fields for every frame of a CaptureStore,
+        unpacking them straight from its buffer.
+        """
+        unpack = self.struct.unpack_from
+        data = store.data
+        base = self.offset
+        for offset, length in zip(store.offsets, store.lengths):
+            if length < self.length:
+                raise Exception(
+                    "Frame of %d bytes is shorter than layout of %d bytes"
+                    % (length, self.length)
+                )
+            values = unpack(data, offset + base)
+            yield values if self.simple else self.convert(values)
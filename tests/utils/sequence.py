@@ -0,0 +1,235 @@
+import numpy as np
+
+from .patterns import HEADERS
+from .validate import capture_array
+
+
+# signature is carried by a TCP header template appended to packet of flow,
+# i.e. in payload of the flow, since snappi payloads are fixed per flow
+SIGNATURE_LENGTH = 8
+# offsets of flow id (2 bytes) and sequence number (4 bytes) in signature
+SIGNATURE_FLOW_ID = 0
+SIGNATURE_SEQ = 4
+# number of bitmap bytes unpacked at a time when looking for lost packets
+BITMAP_CHUNK = 1 << 20
+
+
+def add_sequence_signature(flow, flow_id, packets):
+    """
+    Stamps given flow id and a sequence number (0, 1, ..., packets - 1) in
+    payload of every packet of a flow, by appending a TCP header template
+    whose source port carries flow id and sequence number carries packet
+    sequence. Returns offset of signature in captured frames, which is
+    to be passed to SequenceTracker.update_frames().
+    Headers of flow must be known to HEADERS, so that offset of payload can
+    be determined.
+    Usage
+    -----
+    ```
+    offset = add_sequence_signature(flow, 1, packets)
+    ...
+    tracker = SequenceTracker({1: packets})
+    tracker.update_frames(capture_array(cap_dict["rx"])[0], offset)
+    tracker.assert_ok()
+    ```
+    """
+    offset = 0
+    for header in flow.serialize(flow.DICT).get("packet", []):
+        name = header["choice"]
+        if name not in HEADERS:
+            raise Exception(
+                "Payload offset after %s header is not known" % name
+            )
+        offset += HEADERS[name][0]
+
+    signature = flow.packet.tcp()[-1]
+    signature.src_port.value = flow_id
+    signature.dst_port.value = 0
+    signature.seq_num.increment.start = 0
+    signature.seq_num.increment.step = 1
+    signature.seq_num.increment.count = packets
+    return offset
+
+
+class SequenceTracker(object):
+    """
+    Tracks sequence numbers of received packets of flows stamped using
+    add_sequence_signature(), keeping one bit per expected packet of each
+    flow, to report lost ranges, reordered and duplicate packets. Frames
+    may be fed in batches (e.g. segments fed by stream_captures()) in the
+    order they were received.
+    - received: flow id -> distinct packets received
+    - duplicates: flow id -> packets received more than once
+    - reordered: flow id -> packets received after a later packet
+    - max_reorder: flow id -> largest distance (in sequence numbers) by
+      which a packet arrived late
+    - unknown: frames of unknown flows or with out of range sequence
+    """
+
+    def __init__(self, expected):
+        # expected is a dictionary of flow id and number of packets
+        self.expected = dict(expected)
+        self.bitmaps = {}
+        self.max_seq = {}
+        self.received = {}
+        self.duplicates = {}
+        self.reordered = {}
+        self.max_reorder = {}
+        for flow_id, packets in self.expected.items():
+            self.bitmaps[flow_id] = np.zeros((packets + 7) // 8, np.uint8)
+            self.max_seq[flow_id] = -1
+            self.received[flow_id] = 0
+            self.duplicates[flow_id] = 0
+            self.reordered[flow_id] = 0
+            self.max_reorder[flow_id] = 0
+        self.unknown = 0
+
+    def update_frames(self, frames, offset):
+        """
+        Decodes signature present at given offset of each row of a 2-D
+        frame array (see capture_array()) and tracks it.
+        """
+        end = offset + SIGNATURE_LENGTH
+        if isinstance(frames, np.ndarray):
+            fields = frames[:, offset:end]
+        else:
+            fields = capture_array(frames, end)[0][:, offset:end]
+        fields = fields.astype(np.uint32)
+        i, j = SIGNATURE_FLOW_ID, SIGNATURE_SEQ
+        flow_ids = (fields[:, i] << 8) | fields[:, i + 1]
+        seqs = (fields[:, j] << 24) | (fields[:, j + 1] << 16)
+        seqs |= (fields[:, j + 2] << 8) | fields[:, j + 3]
+        self.update(flow_ids, seqs)
+
+    def update(self, flow_ids, seqs):
+        """
+        Tracks given arrays of flow ids and sequence numbers, one entry per
+        packet in the order packets were received.
+        """
+        flow_ids = np.asarray(flow_ids)
+        seqs = np.asarray(seqs, dtype=np.int64)
+        for flow_id in np.unique(flow_ids).tolist():
+            seq = seqs[flow_ids == flow_id]
+            if flow_id not in self.bitmaps:
+                self.unknown += len(seq)
+                continue
+            valid = seq < self.expected[flow_id]
+            self.unknown += int((~valid).sum())
+            self.track(flow_id, seq[valid])
+
+    def track(self, flow_id, seq):
+        bitmap = self.bitmaps[flow_id]
+        index, bit = seq >> 3, np.left_shift(1, seq & 7).astype(np.uint8)
+
+        # duplicates of packets received in earlier batches or this one
+        duplicate = (bitmap[index] & bit) != 0
+        first = np.unique(seq, return_index=True)[1]
+        repeated = np.ones(len(seq), dtype=bool)
+        repeated[first] = False
+        duplicate |= repeated
+        np.bitwise_or.at(bitmap, index, bit)
+
+        # packets arriving after a packet with higher sequence number
+        previous = np.concatenate(([self.max_seq[flow_id]], seq))
+        highest = np.maximum.accumulate(previous)[:-1]
+        late = (seq < highest) & ~duplicate
+        if late.any():
+            depth = int((highest[late] - seq[late]).max())
+            self.max_reorder[flow_id] = max(self.max_reorder[flow_id], depth)
+        if len(seq) > 0:
+            self.max_seq[flow_id] = max(self.max_seq[flow_id], int(seq.max()))
+
+        self.received[flow_id] += int((~duplicate).sum())
+        self.duplicates[flow_id] += int(duplicate.sum())
+        self.reordered[flow_id] += int(late.sum())
+
+    def lost(self, flow_id):
+        """
+        Returns list of (first, last) sequence number ranges of packets of
+        given flow which were not received.
+        """
+        bitmap = self.bitmaps[flow_id]
+        packets = self.expected[flow_id]
+        ranges = []
+        for start in range(0, len(bitmap), BITMAP_CHUNK):
+            stop = min(start + BITMAP_CHUNK, len(bitmap))
+            bits = np.unpackbits(bitmap[start:stop], bitorder="little")
+            missing = np.flatnonzero(bits == 0) + start * 8
+            missing = missing[missing < packets]
+            if len(missing) == 0:
+                continue
+            # split missing sequence numbers into consecutive runs
+            breaks = np.flatnonzero(np.diff(missing) > 1)
+            firsts = np.concatenate(([missing[0]], missing[breaks + 1]))
+            lasts = np.concatenate((missing[breaks], [missing[-1]]))
+            for first, last in zip(firsts.tolist(), lasts.tolist()):
+                if ranges and ranges[-1][1] == first - 1:
+                    ranges[-1] = (ranges[-1][0], last)
+                else:
+                    ranges.append((first, last))
+        return ranges
+
+    def ok(self):
+        for flow_id in self.expected:
+            if self.received[flow_id] != self.expected[flow_id]:
+                return False
+            if self.duplicates[flow_id] or self.reordered[flow_id]:
+                return False
+        return self.unknown == 0
+
+    def assert_ok(self):
+        """
+        Raises AssertionError describing loss, reorder and duplicates of
+        first flow which is not as expected.
+        """
+        for flow_id in self.expected:
+            lost = self.expected[flow_id] - self.received[flow_id]
+            if lost or self.duplicates[flow_id] or self.reordered[flow_id]:
+                raise AssertionError(
+                    "Flow %d lost %d packets in ranges %s, got %d duplicates "
+                    "and %d reordered packets (max depth %d)"
+                    % (
+                        flow_id,
+                        lost,
+                        self.lost(flow_id)[:10],
+                        self.duplicates[flow_id],
+                        self.reordered[flow_id],
+                        self.max_reorder[flow_id],
+                    )
+                )
+        if self.unknown:
+            raise AssertionError(
+                "Got %d frames without a known signature" % self.unknown
+            )
+
+    def print_report(self):
+        row_format = "{:>10}{:>12}{:>12}{:>12}{:>12}{:>12}{:>12}"
+        border = "-" * 82
+        print("\nSequence Report")
+        print(border)
+        print(
+            row_format.format(
+                "Flow",
+                "Expected",
+                "Received",
+                "Lost",
+                "Duplicates",
+                "Reordered",
+                "Max Depth",
+            )
+        )
+        for flow_id in sorted(self.expected):
+            print(
+                row_format.format(
+                    flow_id,
+                    self.expected[flow_id],
+                    self.received[flow_id],
+                    self.expected[flow_id] - self.received[flow_id],
+                    self.duplicates[flow_id],
+                    self.reordered[flow_id],
+                    self.max_reorder[flow_id],
+                )
+            )
+        print(row_format.format("unknown", "", self.unknown, "", "", "", ""))
+        print(border)
+        print("")
@@ -0,0 +1,243 @@
+import re
+import socket
+
+import numpy as np
+
+from .common import settings
+from .export import IPV4_MAPPED_PREFIX, decode_columns
+
+
+# bytes of preamble, start of frame delimiter and minimum inter frame gap
+# accompanying every frame on the wire
+FRAME_OVERHEAD = 20
+# gap percentiles reported by analyze_timing()
+TIMING_PERCENTILES = (50, 90, 99)
+RATE_UNITS = {"bps": 1, "kbps": 1e3, "mbps": 1e6, "gbps": 1e9}
+
+
+class TimingStats(object):
+    """
+    Inter-arrival statistics of a group of captured frames (e.g. a flow),
+    where all times are in nanoseconds.
+    - gaps: percentile -> inter-arrival gap
+    - jitter: percentile -> absolute difference of consecutive gaps (i.e.
+      packet delay variation between consecutive frames)
+    - bursts: number of runs of frames arriving closer than burst gap
+    - max_burst: frames in longest burst
+    - pps, bps: achieved rate between first and last frame, 0 when they
+      carry same timestamp
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.bytes = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.min_gap = None
+        self.max_gap = None
+        self.mean_gap = None
+        self.gaps = {}
+        self.jitter = {}
+        self.bursts = 0
+        self.max_burst = 0
+        self.pps = 0
+        self.bps = 0
+
+    def duration(self):
+        """
+        Returns seconds elapsed between first and last frame.
+        """
+        if self.first_ts is None:
+            return 0
+        return (self.last_ts - self.first_ts) / 1e9
+
+    def rate_error(self, expected_pps):
+        """
+        Returns relative deviation of achieved rate from expected rate.
+        """
+        return abs(self.pps - expected_pps) / float(expected_pps)
+
+
+def ip_to_str(addr):
+    """
+    Returns string form of a 16 byte IP column value (see decode_columns()).
+    """
+    if addr[:12] == IPV4_MAPPED_PREFIX.tobytes():
+        return socket.inet_ntop(socket.AF_INET, addr[12:])
+    return socket.inet_ntop(socket.AF_INET6, addr)
+
+
+def flow_buckets(store):
+    """
+    Returns (keys, buckets) grouping frames of given CaptureStore by flow,
+    where keys is a list of (src ip, dst ip, protocol, src port, dst port)
+    and buckets holds index of key for each frame.
+    """
+    columns = decode_columns(store)
+    fields = np.hstack(
+        [
+            columns["src_ip"],
+            columns["dst_ip"],
+            columns["protocol"].reshape(-1, 1),
+            columns["src_port"].astype(">u2").view(np.uint8).reshape(-1, 2),
+            columns["dst_port"].astype(">u2").view(np.uint8).reshape(-1, 2),
+        ]
+    )
+    fields = np.ascontiguousarray(fields)
+    fields = fields.view(np.dtype((np.void, fields.shape[1]))).ravel()
+    distinct, buckets = np.unique(fields, return_inverse=True)
+    keys = []
+    for key in distinct:
+        key = key.tobytes()
+        keys.append(
+            (
+                ip_to_str(key[0:16]),
+                ip_to_str(key[16:32]),
+                key[32],
+                int.from_bytes(key[33:35], "big"),
+                int.from_bytes(key[35:37], "big"),
+            )
+        )
+    return keys, buckets.ravel()
+
+
+def analyze_timing(store, buckets=None, names=None, burst_gap=None):
+    """
+    Returns list of TimingStats, one per group of frames of given
+    CaptureStore, where `buckets` holds index of group of each frame (e.g.
+    as returned by flow_buckets() or FrameClassifier.classify_array()),
+    negative for frames to be skipped. All frames form a single group when
+    buckets are not provided.
+    Frames of a group arriving within `burst_gap` nanoseconds of previous
+    frame are counted as a burst, which defaults to half of median gap of
+    that group.
+    Usage
+    -----
+    ```
+    (stats,) = analyze_timing(cap_dict["rx"])
+    assert stats.rate_error(flow_rate_pps(cfg.flows[0])) < 0.05
+    ```
+    """
+    timestamps = np.frombuffer(store.timestamps, dtype=np.uint64)
+    lengths = np.frombuffer(store.wire_lengths, dtype=np.uint64)
+    if buckets is None:
+        buckets = np.zeros(len(timestamps), dtype=np.int64)
+    buckets = np.asarray(buckets, dtype=np.int64)
+    if len(buckets) != len(timestamps):
+        raise Exception(
+            "Got %d buckets for %d frames" % (len(buckets), len(timestamps))
+        )
+    if (timestamps == 0).any():
+        raise Exception("Capture does not carry timestamps of all frames")
+
+    groups = int(buckets.max()) + 1 if len(buckets) else 0
+    if names is None:
+        names = [str(i) for i in range(groups)]
+    # frames sorted by group and by arrival time within a group
+    order = np.lexsort((timestamps, buckets))
+    order = order[buckets[order] >= 0]
+    bounds = np.searchsorted(buckets[order], np.arange(groups + 1))
+
+    results = []
+    for group in range(groups):
+        stats = TimingStats(names[group])
+        start, end = bounds[group], bounds[group + 1]
+        rows = order[start:end]
+        results.append(stats)
+        stats.frames = len(rows)
+        if stats.frames == 0:
+            continue
+        ts = timestamps[rows].astype(np.int64)
+        stats.bytes = int(lengths[rows].sum())
+        stats.first_ts, stats.last_ts = int(ts[0]), int(ts[-1])
+        if stats.frames < 2:
+            continue
+
+        gaps = np.diff(ts)
+        stats.min_gap, stats.max_gap = int(gaps.min()), int(gaps.max())
+        stats.mean_gap = float(gaps.mean())
+        percentiles = np.percentile(gaps, TIMING_PERCENTILES)
+        stats.gaps = dict(zip(TIMING_PERCENTILES, percentiles.tolist()))
+        if len(gaps) > 1:
+            jitter = np.percentile(np.abs(np.diff(gaps)), TIMING_PERCENTILES)
+            stats.jitter = dict(zip(TIMING_PERCENTILES, jitter.tolist()))
+
+        limit = burst_gap
+        if limit is None:
+            limit = stats.gaps[50] / 2.0
+        close = np.concatenate(([False], gaps < limit, [False]))
+        # starts and ends of runs of gaps shorter than burst gap
+        edges = np.flatnonzero(np.diff(close.astype(np.int8)))
+        runs = edges[1::2] - edges[0::2]
+        stats.bursts = len(runs)
+        stats.max_burst = int(runs.max()) + 1 if len(runs) else 0
+
+        seconds = stats.duration()
+        if seconds == 0:
+            continue
+        stats.pps = (stats.frames - 1) / seconds
+        stats.bps = (stats.bytes - int(lengths[rows[-1]])) * 8 / seconds
+    return results
+
+
+def port_speed_bps(speed=None):
+    """
+    Returns line rate in bits per second for given layer1 speed (e.g.
+    speed_100_gbps), which defaults to `speed` setting.
+    """
+    if speed is None:
+        speed = settings.speed
+    match = re.match(r"speed_(\d+)_(?:[fh]d_)?([mg])bps", str(speed))
+    if match is None:
+        raise Exception("Unsupported speed %s" % speed)
+    return int(match.group(1)) * (1e9 if match.group(2) == "g" else 1e6)
+
+
+def flow_rate_pps(flow, speed=None):
+    """
+    Returns rate in packets per second configured for given flow, where
+    percentage and bit rates are converted using fixed frame size of flow
+    and line rate of port (see port_speed_bps()).
+    """
+    choice = flow.rate.choice
+    if choice == "pps":
+        return float(flow.rate.pps)
+    bits = (flow.size.fixed + FRAME_OVERHEAD) * 8.0
+    if choice == "percentage":
+        return flow.rate.percentage / 100.0 * port_speed_bps(speed) / bits
+    return getattr(flow.rate, choice) * RATE_UNITS[choice] / bits
+
+
+def print_timing(results):
+    row_format = "{:>20}{:>10}{:>12}{:>12}{:>12}{:>12}{:>10}{:>14}"
+    border = "-" * 102
+    print("\nTiming (gaps and jitter in microseconds)")
+    print(border)
+    print(
+        row_format.format(
+            "Name",
+            "Frames",
+            "Gap p50",
+            "Gap p99",
+            "Jitter p50",
+            "Jitter p99",
+            "Bursts",
+            "PPS",
+        )
+    )
+    for stats in results:
+        print(
+            row_format.format(
+                stats.name,
+                stats.frames,
+                "%.3f" % (stats.gaps.get(50, 0) / 1e3),
+                "%.3f" % (stats.gaps.get(99, 0) / 1e3),
+                "%.3f" % (stats.jitter.get(50, 0) / 1e3),
+                "%.3f" % (stats.jitter.get(99, 0) / 1e3),
+                stats.bursts,
+                "%.1f" % stats.pps,
+            )
+        )
+    print(border)
+    print("")
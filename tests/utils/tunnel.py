@@ -0,0 +1,119 @@
+import numpy as np
+
+from .analysis import IP_PROTO_UDP
+from .capture import CaptureStore
+from .export import VXLAN_PORT, gather, header_window, l3_offsets, l4_offsets
+from .export import to_uint
+
+
+# length of UDP and VXLAN headers preceding inner ethernet frame
+VXLAN_OVERHEAD = 8 + 8
+# flag marking VNI of VXLAN header as valid
+VXLAN_FLAG_VNI = 0x08
+
+
+class TunnelIndex(object):
+    """
+    Index of VXLAN frames of a CaptureStore grouped by VNI, built by
+    index_tunnels().
+    - vnis: distinct VNIs in ascending order
+    - frames: index of each VXLAN frame in store, grouped by VNI and in
+      order of arrival within a VNI
+    - inner: offset of inner ethernet frame within each of those frames
+    - bounds: VNI -> (start, end) such that frames[start:end] are frames of
+      that VNI
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.vnis = []
+        self.frames = np.empty(0, dtype=np.int64)
+        self.inner = np.empty(0, dtype=np.int64)
+        self.bounds = {}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def counts(self):
+        """
+        Returns a dictionary of VNI and number of frames carried.
+        """
+        return {vni: end - start for vni, (start, end) in self.bounds.items()}
+
+    def inner_store(self, vni):
+        """
+        Returns a CaptureStore holding inner frames of given VNI as slices
+        of the buffer of indexed store, hence no bytes are copied and all
+        capture helpers (e.g. capture_array(), decode_columns()) can be used
+        on inner frames.
+        """
+        inner = CaptureStore(data=self.store.data)
+        start, end = self.bounds.get(vni, (0, 0))
+        rows = self.frames[start:end].tolist()
+        skips = self.inner[start:end].tolist()
+        store = self.store
+        for row, skip in zip(rows, skips):
+            inner.add_frame(
+                store.offsets[row] + skip,
+                store.lengths[row] - skip,
+                store.timestamps[row],
+                store.wire_lengths[row] - skip,
+            )
+        return inner
+
+    def print_report(self):
+        row_format = "{:>20}{:>15}"
+        border = "-" * 35
+        print("\nVXLAN Tunnels")
+        print(border)
+        print(row_format.format("VNI", "Frames"))
+        for vni, frames in self.counts().items():
+            print(row_format.format(vni, frames))
+        print(row_format.format("total", len(self)))
+        print(border)
+        print("")
+
+
+def index_tunnels(store, port=VXLAN_PORT):
+    """
+    Locates outer IPv4 or IPv6, UDP (to given destination port) and VXLAN
+    headers of all frames of given CaptureStore in a single vectorized pass
+    over their leading bytes, and returns a TunnelIndex of frames carrying
+    a valid VNI. Frames whose inner ethernet header is not captured are
+    skipped.
+    Usage
+    -----
+    ```
+    index = index_tunnels(cap_dict["rx"])
+    assert sorted(index.vnis) == list(range(1001, 1129))
+    columns = decode_columns(index.inner_store(1001))
+    ```
+    """
+    index = TunnelIndex(store)
+    if len(store) == 0:
+        return index
+    lengths = np.frombuffer(store.lengths, dtype=np.uint64).astype(np.int64)
+    window = header_window(store)
+    l3, ether_type = l3_offsets(window)
+    ipv4, ipv6, protocol, l4 = l4_offsets(window, l3, ether_type)
+
+    vxlan = (ipv4 | ipv6) & (protocol == IP_PROTO_UDP)
+    vxlan &= to_uint(gather(window, l4 + 2, 2)) == port
+    vxlan &= (gather(window, l4 + 8, 1)[:, 0] & VXLAN_FLAG_VNI) != 0
+    inner = l4 + VXLAN_OVERHEAD
+    # inner ethernet header needs to be captured
+    vxlan &= lengths >= inner + 14
+    vni = to_uint(gather(window, l4 + 12, 3)).astype(np.int64)
+
+    rows = np.flatnonzero(vxlan)
+    order = np.argsort(vni[rows], kind="stable")
+    rows = rows[order]
+    vnis, starts, counts = np.unique(
+        vni[rows], return_index=True, return_counts=True
+    )
+    index.frames = rows
+    index.inner = inner[rows]
+    index.vnis = vnis.tolist()
+    for value, start, count in zip(index.vnis, starts, counts):
+        index.bounds[value] = (int(start), int(start + count))
+    return index
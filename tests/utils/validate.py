@@ -0,0 +1,488 @@
+import math
+import random
+
+import numpy as np
+
+from .analysis import ETHER_TYPE_IPV4, ETHER_TYPE_IPV6
+from .common import settings
+from .export import gather, header_window, l3_offsets, to_uint
+
+
+# number of frames gathered at a time when frames are not laid out back to
+# back in capture buffer, to bound size of temporary index arrays
+GATHER_CHUNK = 1 << 16
+
+
+def capture_array(store, width=None):
+    """
+    Loads frames held by a CaptureStore into a 2-D uint8 array with one row
+    per frame, along with an array of original frame lengths. Only first
+    `width` bytes of each frame are loaded, which defaults to captured length
+    of smallest frame.
+    When frames are evenly spaced in capture buffer (e.g. fixed size frames
+    indexed in place within pcap bytes), returned array is a strided view of
+    the buffer and no bytes are copied.
+    """
+    lengths = np.frombuffer(store.lengths, dtype=np.uint64)
+    wire_lengths = np.frombuffer(store.wire_lengths, dtype=np.uint64)
+    offsets = np.frombuffer(store.offsets, dtype=np.uint64)
+    buf = np.frombuffer(store.data, dtype=np.uint8)
+    if len(lengths) == 0:
+        return np.empty((0, width or 0), dtype=np.uint8), wire_lengths
+
+    if width is None:
+        width = int(lengths.min())
+    elif width > lengths.min():
+        raise Exception(
+            "Width %d exceeds smallest captured frame of %d bytes"
+            % (width, lengths.min())
+        )
+
+    count = len(offsets)
+    start = int(offsets[0])
+    stride = (int(offsets[-1]) - start) // (count - 1) if count > 1 else width
+    if stride >= width and np.array_equal(
+        offsets, start + np.arange(count, dtype=np.uint64) * stride
+    ):
+        frames = np.lib.stride_tricks.as_strided(
+            buf[start:],
+            shape=(count, width),
+            strides=(stride, 1),
+            writeable=False,
+        )
+        return frames, wire_lengths
+
+    frames = np.empty((count, width), dtype=np.uint8)
+    cols = np.arange(width, dtype=np.uint64)
+    for i in range(0, count, GATHER_CHUNK):
+        stop = min(i + GATHER_CHUNK, count)
+        frames[i:stop] = buf[offsets[i:stop, None] + cols]
+    return frames, wire_lengths
+
+
+def expected_array(values):
+    """
+    Converts a sequence of expected field values, where each value is a
+    sequence of bytes (e.g. bytearray([0x13, 0x88])), to a 2-D uint8 array
+    with one row per value.
+    """
+    if isinstance(values, (bytes, bytearray, memoryview)):
+        values = [values]
+    rows = [bytearray(v) for v in values]
+    data = np.frombuffer(bytes(bytearray().join(rows)), dtype=np.uint8)
+    return data.reshape(len(rows), -1)
+
+
+def column_mismatches(frames, start, end, values, rows=None):
+    """
+    Returns indices of frames whose bytes in range [start, end) do not match
+    expected values, where frame i is expected to carry values[i % n] and n
+    is number of expected values. When `rows` (sorted frame indices) is
+    provided, only those frames are checked.
+    """
+    expected = expected_array(values)
+    if expected.shape[1] != end - start:
+        raise Exception(
+            "Expected values are %d bytes wide, field %d:%d is %d bytes wide"
+            % (expected.shape[1], start, end, end - start)
+        )
+    if rows is not None:
+        expected = expected[rows % len(expected)]
+        actual = frames[rows, start:end]
+        return rows[np.flatnonzero((actual != expected).any(axis=1))]
+    # np.resize repeats expected rows cyclically to match number of frames
+    expected = np.resize(expected, (len(frames), end - start))
+    return np.flatnonzero((frames[:, start:end] != expected).any(axis=1))
+
+
+def validate_columns(frames, checks, rows=None):
+    """
+    Raises AssertionError if any of the checks fail for any frame, where
+    checks is a list of (start, end, values) as accepted by
+    column_mismatches().
+    Usage
+    -----
+    ```
+    frames, lengths = capture_array(cap_dict["rx"])
+    validate_columns(frames, [(34, 36, src_ports), (36, 38, dst_ports)])
+    assert (lengths == size).all()
+    ```
+    Only frames at `rows` are checked when provided, which otherwise are
+    sampled as per sampling settings (see sample_rows()).
+    """
+    if rows is None:
+        rows = sample_rows(len(frames))
+    for start, end, values in checks:
+        bad = column_mismatches(frames, start, end, values, rows)
+        if len(bad) > 0:
+            expected = expected_array(values)
+            first = int(bad[0])
+            raise AssertionError(
+                "Bytes %d:%d of %d/%d frames are not as expected, first at "
+                "frame %d: expected %s, got %s"
+                % (
+                    start,
+                    end,
+                    len(bad),
+                    len(frames) if rows is None else len(rows),
+                    first,
+                    bytes(expected[first % len(expected)]).hex(),
+                    bytes(frames[first, start:end]).hex(),
+                )
+            )
+
+
+def validate_lengths(store, size=None):
+    """
+    Raises AssertionError if original length of any frame of given
+    CaptureStore differs from `size` (when provided), or is shorter than
+    its captured length or than its IP packet (i.e. IPv4 total length or
+    IPv6 payload length past ethernet and VLAN headers). Only leading header
+    bytes are read, hence frames truncated to a snap length are validated
+    against their original length as well.
+    Usage
+    -----
+    ```
+    cap_dict = get_all_captures(api, cfg, snap_length=64)
+    validate_lengths(cap_dict["rx"], size)
+    ```
+    """
+    lengths = np.frombuffer(store.lengths, dtype=np.uint64)
+    wire_lengths = np.frombuffer(store.wire_lengths, dtype=np.uint64)
+    if size is not None:
+        bad = np.flatnonzero(wire_lengths != size)
+        if len(bad) > 0:
+            first = int(bad[0])
+            raise AssertionError(
+                "%d/%d frames are not %d bytes long, first at frame %d of "
+                "%d bytes"
+                % (len(bad), len(store), size, first, wire_lengths[first])
+            )
+    bad = np.flatnonzero(lengths > wire_lengths)
+    if len(bad) > 0:
+        first = int(bad[0])
+        raise AssertionError(
+            "%d/%d frames are captured beyond their length, first at frame "
+            "%d: %d > %d bytes"
+            % (
+                len(bad),
+                len(store),
+                first,
+                lengths[first],
+                wire_lengths[first],
+            )
+        )
+
+    window = header_window(store, 14 + 8 + 6)
+    l3, ether_type = l3_offsets(window)
+    ip_length = np.where(
+        ether_type == ETHER_TYPE_IPV4,
+        to_uint(gather(window, l3 + 2, 2)),
+        0,
+    )
+    ip_length = np.where(
+        ether_type == ETHER_TYPE_IPV6,
+        to_uint(gather(window, l3 + 4, 2)) + 40,
+        ip_length,
+    )
+    needed = np.where(ip_length > 0, ip_length + l3.astype(np.uint64), 0)
+    bad = np.flatnonzero(needed > wire_lengths)
+    if len(bad) > 0:
+        first = int(bad[0])
+        raise AssertionError(
+            "IP packets of %d/%d frames exceed frame length, first at frame "
+            "%d: %d > %d bytes"
+            % (len(bad), len(store), first, needed[first], wire_lengths[first])
+        )
+
+
+class SequenceResult(object):
+    """
+    Outcome of verify_sequence() over bytes [start, end) of captured frames.
+    - phase: index of expected value carried by first frame
+    - mismatches: indices of frames not carrying values[(phase + i) % n]
+    - slips: indices of frames whose value is not the one following value
+      of previous frame, i.e. where sequence restarts at a different phase
+      due to loss, reorder or duplication
+    - unknown: indices of frames carrying a value not in expected values
+    """
+
+    def __init__(self, start, end, frames, phase):
+        self.start = start
+        self.end = end
+        self.frames = frames
+        self.phase = phase
+        self.mismatches = np.empty(0, dtype=np.int64)
+        self.slips = np.empty(0, dtype=np.int64)
+        self.unknown = np.empty(0, dtype=np.int64)
+
+    def ok(self):
+        return len(self.mismatches) == 0
+
+    def assert_ok(self):
+        """
+        Raises AssertionError describing mismatches, if any.
+        """
+        if self.ok():
+            return
+        raise AssertionError(
+            "Bytes %d:%d of %d/%d frames do not follow expected sequence "
+            "(phase %d), %d phase slips at frames %s, %d unknown values, "
+            "first mismatches at frames %s"
+            % (
+                self.start,
+                self.end,
+                len(self.mismatches),
+                self.frames,
+                self.phase,
+                len(self.slips),
+                self.slips[:10].tolist(),
+                len(self.unknown),
+                self.mismatches[:10].tolist(),
+            )
+        )
+
+
+def verify_sequence(frames, start, end, values, phase=None):
+    """
+    Verifies that bytes [start, end) of consecutive frames (see
+    capture_array()) cycle through expected values (e.g. as compiled by
+    compile_flow() for values, increment or decrement patterns), starting
+    at index `phase` of values, which otherwise is that of first frame
+    carrying a known value. Returns a SequenceResult.
+    All frames are checked in a single vectorized pass, where each value is
+    looked up among sorted expected values to find its position in sequence.
+    Slips are reported accurately only when expected values are distinct.
+    Usage
+    -----
+    ```
+    frames, lengths = capture_array(cap_dict["rx"])
+    for start, end, values in compile_flow(cfg.flows[0]):
+        verify_sequence(frames, start, end, values).assert_ok()
+    ```
+    """
+    expected = expected_array(values)
+    if expected.shape[1] != end - start:
+        raise Exception(
+            "Expected values are %d bytes wide, field %d:%d is %d bytes wide"
+            % (expected.shape[1], start, end, end - start)
+        )
+    count, period = len(frames), len(expected)
+    actual = np.ascontiguousarray(frames[:, start:end])
+    key_type = np.dtype((np.void, end - start))
+    expected_keys = expected.view(key_type).ravel()
+    actual_keys = actual.view(key_type).ravel()
+
+    # stable sort maps repeated values to their first position in sequence
+    order = np.argsort(expected_keys, kind="stable")
+    pos = np.minimum(
+        np.searchsorted(expected_keys[order], actual_keys), period - 1
+    )
+    known = expected_keys[order][pos] == actual_keys
+    index = np.where(known, order[pos], -1)
+
+    if phase is None:
+        first = np.flatnonzero(known)
+        phase = int(index[first[0]] - first[0]) % period if len(first) else 0
+    result = SequenceResult(start, end, count, phase)
+    if count == 0:
+        return result
+
+    expected_index = (phase + np.arange(count)) % period
+    result.mismatches = np.flatnonzero(
+        (actual != expected[expected_index]).any(axis=1)
+    )
+    result.unknown = np.flatnonzero(~known)
+    follows = index[1:] == (index[:-1] + 1) % period
+    result.slips = np.flatnonzero(known[1:] & known[:-1] & ~follows) + 1
+    return result
+
+
+def sample_size(confidence, max_error):
+    """
+    Returns number of frames to be sampled such that, if none of them fail
+    validation, fraction of failing frames in whole capture is below
+    `max_error` with given `confidence` (e.g. 0.99).
+    """
+    return int(math.ceil(math.log(1 - confidence) / math.log(1 - max_error)))
+
+
+def sampling_error(samples, confidence):
+    """
+    Returns upper bound of fraction of failing frames in whole capture, with
+    given `confidence`, when none of the `samples` frames fail validation.
+    """
+    if samples == 0:
+        return 1.0
+    return 1 - (1 - confidence) ** (1.0 / samples)
+
+
+def sample_rows(count, confidence=None, max_error=None, stride=False):
+    """
+    Returns sorted indices of frames to be validated out of `count` frames,
+    picked at random (or at a fixed stride from a random start when `stride`
+    is set), or None when whole capture is to be validated.
+    Number of samples is derived from `confidence` and `max_error`, which
+    default to `capture_sample_confidence` and `capture_sample_error`
+    settings, and sampling is disabled when confidence is not set.
+    Stride sampling is cheaper for very large captures but may alias with
+    patterns whose period divides the stride.
+    """
+    if confidence is None:
+        confidence = getattr(settings, "capture_sample_confidence", None)
+    if confidence is None:
+        return None
+    if max_error is None:
+        max_error = getattr(settings, "capture_sample_error", None) or 0.001
+    confidence, max_error = float(confidence), float(max_error)
+
+    samples = sample_size(confidence, max_error)
+    if samples >= count:
+        return None
+
+    if stride:
+        step = count / float(samples)
+        rows = (random.random() + np.arange(samples)) * step
+        rows = rows.astype(np.int64)
+    else:
+        rng = np.random.default_rng()
+        rows = np.sort(rng.choice(count, samples, replace=False))
+    print(
+        "Validating %d/%d sampled frames, i.e. less than %.4f%% frames "
+        "fail validation with %.2f%% confidence if all samples pass"
+        % (
+            samples,
+            count,
+            sampling_error(samples, confidence) * 100,
+            confidence * 100,
+        )
+    )
+    return rows
+
+
+def sample_frames(store, confidence=None, max_error=None):
+    """
+    Yields (index, frame) for frames of given CaptureStore to be validated as
+    per sample_rows(), i.e. all frames when sampling is disabled.
+    """
+    rows = sample_rows(len(store), confidence, max_error)
+    if rows is None:
+        for i, frame in enumerate(store):
+            yield i, frame
+    else:
+        for i in rows:
+            yield int(i), store[i]
+
+
+def reservoir_sample(frames, samples):
+    """
+    Returns (index, bytes) of `samples` frames picked uniformly at random
+    from given iterable of frames in a single pass (e.g. iter_captures()),
+    without knowing number of frames upfront.
+    """
+    reservoir = []
+    for i, frame in enumerate(frames):
+        if i < samples:
+            reservoir.append((i, bytes(frame)))
+        else:
+            j = random.randint(0, i)
+            if j < samples:
+                reservoir[j] = (i, bytes(frame))
+    reservoir.sort(key=lambda item: item[0])
+    return reservoir
+
+
+class FrameClassifier(object):
+    """
+    Buckets frames (e.g. per flow or per device) based on bytes present at
+    given byte ranges of each frame, using a hash index so that each frame
+    is classified in constant time irrespective of number of buckets.
+    Usage
+    -----
+    ```
+    classifier = FrameClassifier([(0, 6), (26, 30)])
+    for i in range(count):
+        classifier.add_bucket("dev_%d" % i, [dst_mac[i], src_ip[i]])
+    for b in cap_dict["rx"]:
+        i = classifier.classify(b)
+    classifier.print_counts()
+    assert classifier.unclassified == 0
+    ```
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.index = {}
+        self.names = []
+        self.counts = []
+        self.unclassified = 0
+
+    def add_bucket(self, name, values):
+        """
+        Adds a bucket for frames carrying given values, one per field, and
+        returns index of the bucket.
+        """
+        if len(values) != len(self.fields):
+            raise Exception(
+                "Bucket %s has %d values for %d fields"
+                % (name, len(values), len(self.fields))
+            )
+        key = b"".join(bytes(bytearray(v)) for v in values)
+        if key in self.index:
+            raise Exception(
+                "Bucket %s has same values as bucket %s"
+                % (name, self.names[self.index[key]])
+            )
+        self.index[key] = len(self.names)
+        self.names.append(name)
+        self.counts.append(0)
+        return self.index[key]
+
+    def key(self, frame):
+        return b"".join(bytes(frame[start:end]) for start, end in self.fields)
+
+    def classify(self, frame):
+        """
+        Returns index of bucket given frame belongs to, or None if it does
+        not belong to any.
+        """
+        bucket = self.index.get(self.key(frame))
+        if bucket is None:
+            self.unclassified += 1
+        else:
+            self.counts[bucket] += 1
+        return bucket
+
+    def classify_array(self, frames):
+        """
+        Returns array holding index of bucket for each row of given 2-D frame
+        array (see capture_array()), or -1 for rows not belonging to any.
+        Frames are grouped by distinct keys first, hence index is looked up
+        once per distinct key instead of once per frame.
+        """
+        cols = np.concatenate([np.arange(s, e) for s, e in self.fields])
+        keys = np.ascontiguousarray(frames[:, cols])
+        keys = keys.view(np.dtype((np.void, keys.shape[1]))).ravel()
+        distinct, inverse = np.unique(keys, return_inverse=True)
+        lookup = np.array(
+            [self.index.get(k.tobytes(), -1) for k in distinct], dtype=np.int64
+        )
+        buckets = lookup[inverse.ravel()]
+
+        counts = np.bincount(buckets[buckets >= 0], minlength=len(self.names))
+        for i, count in enumerate(counts):
+            self.counts[i] += int(count)
+        self.unclassified += int((buckets < 0).sum())
+        return buckets
+
+    def print_counts(self):
+        row_format = "{:>20}{:>15}"
+        border = "-" * 40
+        print("\nClassified Frames")
+        print(border)
+        print(row_format.format("Bucket", "Frames"))
+        for name, count in zip(self.names, self.counts):
+            print(row_format.format(name, count))
+        print(row_format.format("unclassified", self.unclassified))
+        print(border)
+        print("")
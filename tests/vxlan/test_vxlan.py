@@ -98,7 +98,12 @@ def test_vxlan(api, utils):
     flow.metrics.enable = True
     flow.metrics.loss = True
 
-    utils.start_traffic(api, config, start_capture=False)
+    # capturing tunnels is opt-in, since capture may affect the traffic
+    tunnels = str(utils.settings.capture_tunnels).lower() == "true"
+    if tunnels:
+        config.captures.capture(name="c1")[-1].port_names = [p2.name]
+
+    utils.start_traffic(api, config, start_capture=tunnels)
 
     utils.wait_for(
         lambda: results_ok(api, ["f1"], 100),
@@ -107,6 +112,14 @@ def test_vxlan(api, utils):
     )
     utils.stop_traffic(api, config)
 
+    if tunnels:
+        # traffic is carried by tunnel of VNI 1000
+        captures = utils.get_all_captures(api, config)
+        index = utils.index_tunnels(captures[p2.name])
+        index.print_report()
+        assert len(index) > 0
+        assert set(index.vnis) <= set([d2_vxlan.vni])
+
 
 def results_ok(api, flow_names, expected):
     """
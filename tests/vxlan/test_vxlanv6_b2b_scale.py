@@ -6,6 +6,8 @@ def test_vxlanv6_b2b_scale(api, utils):
     1. Create 128 loopbacks and advertise them using BGP.
     2. Create VXLAN connected to each loopback, so total 128 vxlan tunnels.
     3. Create BGP devices in VXLAN and advertise the routes.
+    4. Validate that traffic is carried by configured vxlan tunnels, when
+       capture_tunnels setting is set.
     """
     count = 128
     config = api.config()
@@ -175,7 +177,12 @@ def test_vxlanv6_b2b_scale(api, utils):
     flow.metrics.enable = True
     flow.metrics.loss = True
 
-    utils.start_traffic(api, config, start_capture=False)
+    # capturing tunnels is opt-in, since capture may affect the traffic
+    tunnels = str(utils.settings.capture_tunnels).lower() == "true"
+    if tunnels:
+        config.captures.capture(name="c1")[-1].port_names = [p2.name]
+
+    utils.start_traffic(api, config, start_capture=tunnels)
 
     assert (
         api._ixnetwork.Topology.find()[0]
@@ -199,6 +206,13 @@ def test_vxlanv6_b2b_scale(api, utils):
     )
     utils.stop_traffic(api, config)
 
+    if tunnels:
+        captures = utils.get_all_captures(api, config)
+        index = utils.index_tunnels(captures[p2.name])
+        index.print_report()
+        assert len(index) > 0
+        assert set(index.vnis) <= set(range(1001, count + 1001))
+
 
 def get_macs(mac, count, offset=1):
     """